@@ -0,0 +1,68 @@
+"""Compare the per-tile shadow engine against the visibility polygon engine as occluders are added.
+
+Occluders are square tiles scattered around the light, all within its radius, so every one of them
+casts a shadow. Each engine casts the shadows of the same scenes from several light positions.
+
+Run from the project root with: python -m benchmarks.lighting
+"""
+import os
+import time
+
+# Surfaces need a display, which doesn't have to be visible
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pygame
+
+import src.lighting.lighting as lighting
+
+SIZE = 500
+TILE_SIZE = 32
+COUNTS = (0, 10, 25, 50, 100, 200, 400)
+POSITIONS = 20
+
+def scatter(count: int, rng: np.random.Generator) -> list[pygame.Rect]:
+    """Scatter tiles over the light's square, leaving the middle clear for the light to stand in."""
+    rects = []
+
+    while len(rects) < count:
+        x, y = rng.integers(0, SIZE - TILE_SIZE, 2)
+        rect = pygame.Rect(int(x), int(y), TILE_SIZE, TILE_SIZE)
+
+        if not rect.inflate(TILE_SIZE * 2, TILE_SIZE * 2).collidepoint(SIZE // 2, SIZE // 2):
+            rects.append(rect)
+
+    return rects
+
+def measure(light: lighting.Light, tiles: lighting.OccluderIndex, positions: list[tuple[int, int]]) -> list[float]:
+    """Time casting the light's shadows at every position, in milliseconds."""
+    times = []
+
+    for x, y in positions:
+        begin = time.perf_counter()
+        light.cast_shadows(tiles, x, y)
+        times.append((time.perf_counter() - begin) * 1000)
+
+    return times
+
+def main():
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    rng = np.random.default_rng(0)
+    shader = lighting.pixel_shader(SIZE, (255, 245, 182), 1, False)
+    engines = {"tiles": lighting.Light(SIZE, shader), "visibility": lighting.VisibilityLight(SIZE, shader)}
+
+    # Small moves around the middle, so the occluders stay in reach
+    positions = [tuple(int(v) for v in SIZE // 2 + rng.integers(-8, 9, 2)) for _ in range(POSITIONS)]
+
+    print(f"{'occluders':<12}{'engine':<12}{'mean':>13}{'median':>13}")
+
+    for count in COUNTS:
+        tiles = lighting.OccluderIndex(scatter(count, rng))
+
+        for name, light in engines.items():
+            times = measure(light, tiles, positions)
+            print(f"{count:<12}{name:<12}{np.mean(times):>10.3f} ms{np.median(times):>10.3f} ms")
+
+if __name__ == "__main__":
+    main()
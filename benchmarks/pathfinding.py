@@ -0,0 +1,101 @@
+"""Compare Jump Point Search against A* on the shipped maps and on large synthetic grids.
+
+Run from the project root with: python -m benchmarks.pathfinding
+"""
+import os
+import time
+
+# Loading tilemaps needs a display, which doesn't have to be visible
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pygame
+
+from src.lib.tilemap import TiledMap
+from src.lib.navmesh import Navmesh
+from src.math import a_star, jps
+
+MAPS = ("ruinMap", "caveMap")
+
+def shipped_grid(name: str) -> np.ndarray:
+    """Get the walkability grid the game builds for a shipped map."""
+    tilemap = TiledMap(f"assets/maps/{name}.tmx")
+    navmesh = Navmesh((tilemap.width, tilemap.height), 32, tilemap, ("Barriers",), cache_dir=None)
+    return np.array(navmesh.walkable)
+
+def synthetic_grid(size: int, density: float, rng: np.random.Generator) -> np.ndarray:
+    """Create a square grid with a fraction of its cells randomly blocked."""
+    return rng.random((size, size)) >= density
+
+def random_pairs(walkable: np.ndarray, count: int, rng: np.random.Generator) -> list[tuple[int, int]]:
+    """Pick random pairs of walkable cells to search between."""
+    cells = np.flatnonzero(walkable)
+    return [(int(a), int(b)) for a, b in rng.choice(cells, (count, 2))]
+
+def path_cost(path: list[int], cols: int) -> float:
+    """Get the length of a path of cells or jump points."""
+    cost = 0.0
+    for a, b in zip(path, path[1:]):
+        cost += a_star.heuristic(*divmod(a, cols), *divmod(b, cols))
+    return cost
+
+def compare(name: str, walkable: np.ndarray, pairs: list[tuple[int, int]]):
+    """Run both searches between every pair and print their expansions and wall time."""
+    cols = walkable.shape[1]
+    results = {}
+
+    # The jump table is built once per grid, like the navmesh does
+    begin = time.perf_counter()
+    jumps = jps.JumpTable(walkable)
+    print(f"{name:<22}{'table':<8}{(time.perf_counter() - begin) * 1000:>10.3f} ms")
+
+    for engine in (a_star, jps):
+        options = {"jumps": jumps} if engine is jps else {}
+
+        times = []
+        expansions = []
+        costs = []
+
+        for start, target in pairs:
+            stats = {}
+            begin = time.perf_counter()
+            path = engine.search(walkable, start, target, stats=stats, **options)
+            times.append(time.perf_counter() - begin)
+            expansions.append(stats.get("expansions", 0))
+            costs.append(path_cost(path, cols) if path else None)
+
+        results[engine.__name__.split(".")[-1]] = (times, expansions, costs)
+
+    # Both engines are optimal, so their path lengths have to agree
+    mismatches = sum(
+        1 for a, b in zip(results["a_star"][2], results["jps"][2])
+        if (a is None) != (b is None) or (a is not None and abs(a - b) > 1e-6)
+    )
+
+    for engine, (times, expansions, _) in results.items():
+        print(
+            f"{name:<22}{engine:<8}"
+            f"{np.mean(times) * 1000:>10.3f} ms{np.median(times) * 1000:>10.3f} ms"
+            f"{np.mean(expansions):>12.0f}"
+        )
+
+    if mismatches:
+        print(f"{name:<22}{mismatches} paths differ in length")
+
+def main():
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    rng = np.random.default_rng(0)
+
+    print(f"{'grid':<22}{'engine':<8}{'mean':>13}{'median':>13}{'expansions':>12}")
+
+    for name in MAPS:
+        walkable = shipped_grid(name)
+        compare(name, walkable, random_pairs(walkable, 50, rng))
+
+    for size, density, count in ((256, 0.0, 20), (256, 0.2, 20), (1024, 0.0, 5), (1024, 0.2, 5)):
+        walkable = synthetic_grid(size, density, rng)
+        compare(f"{size}x{size} {density:.0%} blocked", walkable, random_pairs(walkable, count, rng))
+
+if __name__ == "__main__":
+    main()
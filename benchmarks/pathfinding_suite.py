@@ -0,0 +1,231 @@
+"""Time the pathfinding building blocks on synthetic grids and save the results as JSON.
+
+Grids are built the way Navmesh builds them, at 64x64, 256x256 and 1024x1024 cells, with
+randomly scattered obstacles and with mazes. Every operation reports p50/p95 latency, search
+expansions and the peak memory allocated while it runs.
+
+Run from the project root with: python -m benchmarks.pathfinding_suite
+Compare against an earlier run with: python -m benchmarks.pathfinding_suite --compare old.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+
+# Nodes are pygame entities, which don't need a visible display
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pygame
+
+from src.lib.navmesh import adjacency, build_nodes, nearest_walkable
+from src.lib.node import get_closest_node, neighbors
+from src.math import a_star
+from benchmarks.pathfinding import random_pairs, synthetic_grid
+
+SIZES = (64, 256, 1024)
+TILE_SIZE = 32
+
+# Obstacle layouts as (kind, density), where a maze's density is the fraction of its walls kept
+LAYOUTS = (("random", 0.1), ("random", 0.3), ("maze", 1.0), ("maze", 0.7))
+
+# The node-level functions scan or copy the whole grid in Python, so larger grids take minutes
+NODE_LIMIT = 256
+
+# Tracing memory makes allocation-heavy calls many times slower, so slow operations skip it
+TRACE_LIMIT_MS = 1000
+
+RESULTS_DIR = "benchmarks/results"
+
+def maze_grid(size: int, density: float, rng: np.random.Generator) -> np.ndarray:
+    """Carve a maze with one-cell corridors, then knock down a fraction of the remaining walls."""
+    walkable = np.zeros((size, size), dtype=bool)
+    rooms = (size - 1) // 2
+
+    # Depth-first carving between rooms at odd coordinates
+    visited = np.zeros((rooms, rooms), dtype=bool)
+    stack = [(0, 0)]
+    visited[0, 0] = True
+    walkable[1, 1] = True
+
+    while stack:
+        row, col = stack[-1]
+        options = [
+            (row + dr, col + dc) for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1))
+            if 0 <= row + dr < rooms and 0 <= col + dc < rooms and not visited[row + dr, col + dc]
+        ]
+
+        if not options:
+            stack.pop()
+            continue
+
+        next_row, next_col = options[rng.integers(len(options))]
+        visited[next_row, next_col] = True
+        walkable[2 * next_row + 1, 2 * next_col + 1] = True
+        walkable[row + next_row + 1, col + next_col + 1] = True
+        stack.append((next_row, next_col))
+
+    # Opening walls inside the border adds loops, so there is more than one way around
+    walls = np.argwhere(~walkable[1:-1, 1:-1]) + 1
+    opened = walls[rng.random(len(walls)) >= density]
+    walkable[opened[:, 0], opened[:, 1]] = True
+
+    return walkable
+
+def build_grid(size: int, kind: str, density: float, rng: np.random.Generator) -> np.ndarray:
+    if kind == "maze":
+        return maze_grid(size, density, rng)
+    return synthetic_grid(size, density, rng)
+
+def measure(run, calls: list, expansions: bool = False, trace_limit_ms: float = TRACE_LIMIT_MS) -> dict:
+    """Time run(*call) for every call, then repeat the first call while tracing memory
+    unless it took longer than trace_limit_ms."""
+    times = []
+    counts = []
+
+    for call in calls:
+        stats = {}
+        begin = time.perf_counter()
+        run(*call, stats) if expansions else run(*call)
+        times.append((time.perf_counter() - begin) * 1000)
+        counts.append(stats.get("expansions", 0))
+
+    result = {
+        "calls": len(calls),
+        "p50_ms": float(np.percentile(times, 50)),
+        "p95_ms": float(np.percentile(times, 95)),
+        "mean_ms": float(np.mean(times)),
+        "peak_kb": None,
+    }
+
+    # Tracing slows every allocation down, so it's kept out of the timed calls
+    if trace_limit_ms is None or times[0] <= trace_limit_ms:
+        tracemalloc.start()
+        run(*calls[0], {}) if expansions else run(*calls[0])
+        result["peak_kb"] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+
+    if expansions:
+        result["expansions"] = float(np.mean(counts))
+
+    return result
+
+def bench_grid(walkable: np.ndarray, queries: int, rng: np.random.Generator, trace_limit_ms: float = TRACE_LIMIT_MS) -> dict:
+    """Time every operation on one grid."""
+    def measure_all(run, calls: list, expansions: bool = False) -> dict:
+        return measure(run, calls, expansions, trace_limit_ms)
+
+    rows, cols = walkable.shape
+    pairs = random_pairs(walkable, queries, rng)
+    positions = [(int(x), int(y)) for x, y in rng.integers(0, cols * TILE_SIZE, (queries, 2))]
+    results = {}
+
+    # Cell-level operations used by the navmesh, on every grid size
+    results["adjacency"] = measure_all(adjacency, [(walkable,)])
+    results["nearest_walkable"] = measure_all(nearest_walkable, [(walkable,)])
+
+    nearest = nearest_walkable(walkable)
+    results["closest_cell"] = measure_all(
+        lambda pos: int(nearest[(pos[1] // TILE_SIZE) * cols + pos[0] // TILE_SIZE]),
+        [(pos,) for pos in positions],
+    )
+    results["search"] = measure_all(
+        lambda start, target, stats: a_star.search(walkable, start, target, stats=stats),
+        pairs, expansions=True,
+    )
+
+    if rows > NODE_LIMIT:
+        return results
+
+    # Node-level operations, on grids small enough to build nodes for
+    results["build_nodes"] = measure_all(build_nodes, [(walkable, adjacency(walkable), TILE_SIZE)])
+    nodes = build_nodes(walkable, adjacency(walkable), TILE_SIZE).rows()
+
+    results["get_closest_node"] = measure_all(lambda pos: get_closest_node(nodes, pos), [(pos,) for pos in positions])
+    results["neighbors"] = measure_all(
+        lambda cell: neighbors(nodes, *divmod(cell, cols)),
+        [(start,) for start, _ in pairs],
+    )
+
+    calls = [
+        (((start % cols) * TILE_SIZE, (start // cols) * TILE_SIZE), ((target % cols) * TILE_SIZE, (target // cols) * TILE_SIZE))
+        for start, target in pairs
+    ]
+    results["algorithm"] = measure_all(lambda current, target: a_star.algorithm(nodes, current, target), calls)
+
+    return results
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: list[dict], baseline_path: str):
+    """Print how much the p50 latency of every operation changed since a saved run."""
+    with open(baseline_path) as file:
+        baseline = {(r["grid"], r["operation"]): r for r in json.load(file)["results"]}
+
+    print(f"\nchange in p50 since {baseline_path}")
+
+    for result in results:
+        old = baseline.get((result["grid"], result["operation"]))
+        if old is None or old["p50_ms"] == 0:
+            continue
+
+        ratio = result["p50_ms"] / old["p50_ms"]
+        flag = "  slower" if ratio > 1.2 else ""
+        print(f"{result['grid']:<22}{result['operation']:<18}{old['p50_ms']:>10.3f} ms ->{result['p50_ms']:>10.3f} ms{ratio:>8.2f}x{flag}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--queries", type=int, default=30, help="queries per operation on each grid")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help=f"results file, defaults to {RESULTS_DIR}/pathfinding-<commit>.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--trace-all", action="store_true", help=f"trace memory even for calls slower than {TRACE_LIMIT_MS} ms")
+    args = parser.parse_args()
+
+    pygame.init()
+    rng = np.random.default_rng(args.seed)
+    results = []
+
+    print(f"{'grid':<22}{'operation':<18}{'p50':>13}{'p95':>13}{'expansions':>12}{'peak':>12}")
+
+    for size in args.sizes:
+        for kind, density in LAYOUTS:
+            grid = f"{size}x{size} {kind} {density:.0%}"
+            walkable = build_grid(size, kind, density, rng)
+
+            for operation, result in bench_grid(walkable, args.queries, rng, None if args.trace_all else TRACE_LIMIT_MS).items():
+                results.append({"grid": grid, "size": size, "layout": kind, "density": density, "operation": operation, **result})
+                peak = "" if result["peak_kb"] is None else f"{result['peak_kb']:.0f} KB"
+                print(
+                    f"{grid:<22}{operation:<18}{result['p50_ms']:>10.3f} ms{result['p95_ms']:>10.3f} ms"
+                    f"{result.get('expansions', 0):>12.0f}{peak:>12}"
+                )
+
+    commit = git_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f"pathfinding-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+    with open(output, "w") as file:
+        json.dump({
+            "commit": commit,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "seed": args.seed,
+            "results": results,
+        }, file, indent=2)
+
+    print(f"\nsaved {len(results)} results to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import math
+import numpy as np
+import pygame
+import src.lighting.lighting as lighting
+
+def reference_pixel_shader(size, color, intensity, point, angle=0, angle_width=360):
+    """The original per-pixel loop that pixel_shader replaced, kept to check its output."""
+    final_array = np.full((size, size, 3), color, dtype=np.uint16)
+    radius = size * 0.5
+
+    for x in range(len(final_array)):
+        for y in range(len(final_array[x])):
+            distance = math.sqrt((x - radius) ** 2 + (y - radius) ** 2)
+
+            radial_falloff = (radius - distance) * (1 / radius)
+
+            if radial_falloff <= 0:
+                radial_falloff = 0
+
+            if not point:
+                angular_falloff = 1
+
+            else:
+                point_angle = (180 / math.pi) * -math.atan2(
+                    (radius - x), (radius - y)
+                ) + 180
+                diff_angle = abs(((angle - point_angle) + 180) % 360 - 180)
+
+                angular_falloff = ((angle_width / 2) - diff_angle) * (1 / angle_width)
+
+                if angular_falloff <= 0:
+                    angular_falloff = 0
+
+            final_intensity = radial_falloff * angular_falloff * intensity
+            final_array[x][y] = final_array[x][y] * final_intensity
+
+    return final_array
+
+# Test the vectorized pixel shader against the per-pixel loop
+def test_pixel_shader():
+    cases = [
+        (64, (255, 245, 182), 1, False),
+        (50, (235, 89, 40), 0.75, False),
+        (64, (9, 171, 235), 0.5, True, 90, 60),
+        (41, (255, 0, 0), 0.5, True, 300, 120),
+    ]
+
+    for case in cases:
+        shader = pygame.surfarray.array3d(lighting.pixel_shader(*case)).astype(np.int32)
+        expected = reference_pixel_shader(*case).astype(np.int32)
+
+        # Assert that every channel matches, allowing for rounding at the truncation to integers
+        assert shader.shape == expected.shape
+        assert np.abs(shader - expected).max() <= 1
+
+# Test building shaders lazily and caching them on disk
+def test_shader_registry(tmp_path):
+    registry = lighting.ShaderRegistry(str(tmp_path))
+
+    # Assert that the first use builds the shader and caches it
+    shader = registry.get(32, (255, 0, 0), 0.5, False)
+    assert len(list(tmp_path.glob("*.npy"))) == 1
+
+    # Assert that the same parameters give the same surface
+    assert registry.get(32, [255, 0, 0], 0.5, False) is shader
+    assert registry.get(32, (255, 0, 0), 0.75, False) is not shader
+
+    # Assert that a new registry loads the cached pixels
+    cached = lighting.ShaderRegistry(str(tmp_path)).get(32, (255, 0, 0), 0.5, False)
+    assert (pygame.surfarray.array3d(cached) == pygame.surfarray.array3d(shader)).all()
+    assert len(list(tmp_path.glob("*.npy"))) == 2
+
+# Test gathering occluders from the spatial index
+def test_occluder_index():
+    # Create a grid of wall tiles, with a few larger rects spanning several buckets
+    rects = [pygame.Rect(x * 64, y * 64, 64, 64) for x in range(20) for y in range(15) if (x * y) % 3 == 0]
+    rects += [pygame.Rect(10, 500, 900, 20), pygame.Rect(700, 0, 30, 960)]
+    index = lighting.OccluderIndex(rects)
+    light = lighting.Light(100, pygame.Surface((100, 100)))
+
+    # Assert that lights gather the same occluders from the index as from the full list
+    for x, y in [(0, 0), (250, 250), (128, 128), (700, 510), (1300, 900), (-80, 400)]:
+        assert light.get_tiles(index, x, y) == light.get_tiles(rects, x, y)
+
+    # Assert that a query only returns rects from nearby buckets
+    assert len(index.query(300, 300, 340, 340)) < len(rects) // 4
+
+# Test baking stationary lights once
+def test_static_light():
+    shader = lighting.pixel_shader(200, (255, 245, 182), 1, False)
+    tiles = [pygame.Rect(140, 60, 40, 40), pygame.Rect(20, 150, 60, 20)]
+
+    def render(light, x, y):
+        display = pygame.Surface((300, 300))
+        light.main(tiles, display, x, y)
+        return pygame.surfarray.array3d(display)
+
+    static = lighting.Light(200, shader, static=True)
+    dynamic = lighting.Light(200, shader)
+
+    # Assert that a static light looks the same as one casting its shadows every frame
+    assert (render(static, 100, 100) == render(dynamic, 100, 100)).all()
+
+    # Assert that later frames reuse the baked surface until the light moves
+    baked = static.baked_pixel_shader_surf
+    render(static, 100, 100)
+    assert static.baked_pixel_shader_surf is baked
+
+    assert (render(static, 120, 90) == render(dynamic, 120, 90)).all()
+    assert static.baked_at == (120, 90)
+
+# Test caching the shadowed surfaces of a moving light
+def test_light_cache():
+    shader = lighting.pixel_shader(200, (255, 245, 182), 1, False)
+    index = lighting.OccluderIndex([pygame.Rect(140, 60, 40, 40), pygame.Rect(20, 150, 60, 20)])
+    light = lighting.Light(200, shader, cache_size=2, cache_grid=4)
+    display = pygame.Surface((300, 300))
+
+    # Assert that positions snapping to the same grid point reuse the surface
+    light.main(index, display, 100, 100)
+    light.main(index, display, 101.5, 99)
+    assert light.stats()["hits"] == 1 and light.stats()["misses"] == 1
+
+    # Assert that the cached surface matches an uncached light
+    cached = pygame.Surface((300, 300))
+    uncached = pygame.Surface((300, 300))
+    light.main(index, cached, 100, 100)
+    lighting.Light(200, shader).main(index, uncached, 100, 100)
+    assert (pygame.surfarray.array3d(cached) == pygame.surfarray.array3d(uncached)).all()
+
+    # Assert that the least recently used surface is evicted
+    light.main(index, display, 120, 100)
+    light.main(index, display, 140, 100)
+    assert light.stats()["size"] == 2
+    light.main(index, display, 100, 100)
+    assert light.stats()["misses"] == 4
+
+    # Assert that changing the occluders misses the cache
+    index.set_rects([])
+    light.main(index, display, 140, 100)
+    assert light.stats()["misses"] == 5
+
+# Test merging wall tiles into larger occluders
+def test_merge_rects():
+    # Create an L shaped wall, a square block and a lone tile
+    tiles = [pygame.Rect(x * 64, 0, 64, 64) for x in range(6)]
+    tiles += [pygame.Rect(0, y * 64, 64, 64) for y in range(1, 5)]
+    tiles += [pygame.Rect(x * 64, y * 64, 64, 64) for x in range(3, 5) for y in range(3, 5)]
+    tiles += [pygame.Rect(448, 448, 64, 64)]
+
+    merged = lighting.merge_rects(tiles)
+
+    # Assert that the merged rects cover exactly the tiles, with no overlaps
+    assert len(merged) == 4
+    assert sum(rect.width * rect.height for rect in merged) == 64 * 64 * len(tiles)
+    assert all(any(rect.contains(tile) for rect in merged) for tile in tiles)
+
+    # Assert that the merged walls cast the same shadows as the tiles
+    shader = lighting.pixel_shader(500, (255, 245, 182), 1, False)
+    for x, y in [(150, 150), (300, 120), (100, 400), (400, 300)]:
+        by_tile = pygame.Surface((600, 600))
+        by_wall = pygame.Surface((600, 600))
+        lighting.Light(500, shader).main(tiles, by_tile, x, y)
+        lighting.Light(500, shader).main(merged, by_wall, x, y)
+        difference = np.abs(pygame.surfarray.array3d(by_tile).astype(np.int32) - pygame.surfarray.array3d(by_wall))
+        assert (difference > 8).sum() == 0
+
+# Test the visibility polygon engine against the per-tile shadows
+def test_visibility_light():
+    shader = lighting.pixel_shader(500, (255, 245, 182), 1, False)
+    tiles = lighting.OccluderIndex([pygame.Rect(300, 150, 64, 192), pygame.Rect(100, 100, 128, 64), pygame.Rect(0, 400, 600, 64)])
+
+    for x, y in [(250, 250), (150, 300), (400, 300)]:
+        by_tile = pygame.Surface((600, 600))
+        by_polygon = pygame.Surface((600, 600))
+        lighting.Light(500, shader).main(tiles, by_tile, x, y)
+        lighting.VisibilityLight(500, shader).main(tiles, by_polygon, x, y)
+        by_tile = pygame.surfarray.array3d(by_tile).astype(np.int32)
+        by_polygon = pygame.surfarray.array3d(by_polygon).astype(np.int32)
+
+        # Assert that both engines light the same area, apart from the pixels along shadow edges
+        assert (np.abs(by_tile - by_polygon).max(axis=2) > 16).mean() < 0.005
+
+    # Assert that a static visibility light bakes the same surface
+    static = lighting.VisibilityLight(500, shader, static=True)
+    baked = pygame.Surface((600, 600))
+    static.main(tiles, baked, 400, 300)
+    assert (pygame.surfarray.array3d(baked) == by_polygon).all()
+
+# Test accumulating lights at a reduced resolution
+def test_light_scale():
+    shader = lighting.pixel_shader(500, (255, 245, 182), 1, False)
+    tiles = lighting.OccluderIndex([pygame.Rect(300, 150, 64, 192), pygame.Rect(100, 100, 128, 64)])
+    full = pygame.Surface((600, 600))
+    lighting.Light(500, shader).main(tiles, full, 250, 250)
+    full = pygame.surfarray.array3d(full).astype(np.int32)
+
+    for light_type in (lighting.Light, lighting.VisibilityLight):
+        for scale in (2, 4):
+            light = light_type(500, shader, scale=scale)
+            assert light.render_surface.get_size() == (500 // scale, 500 // scale)
+
+            # Assert that the scaled up buffer only differs from full resolution along shadow edges
+            buffer = pygame.Surface((600 // scale, 600 // scale))
+            light.main(tiles, buffer, 250, 250)
+            scaled = pygame.surfarray.array3d(pygame.transform.smoothscale(buffer, (600, 600))).astype(np.int32)
+            assert np.abs(scaled - full).mean() < 2
+            assert (np.abs(scaled - full).max(axis=2) > 32).mean() < 0.01
+
+# Test reusing the lighting surfaces between frames
+def test_lighting_compositor():
+    pygame.display.set_mode((1, 1))
+    shader = lighting.pixel_shader(100, (255, 245, 182), 1, False)
+    compositor = lighting.LightingCompositor(50, 2)
+
+    def frame(size):
+        screen = pygame.Surface(size)
+        screen.fill((200, 200, 200))
+        lighting.Light(100, shader, scale=2).main([], compositor.begin(size), 60, 60)
+        compositor.composite(screen)
+        return pygame.surfarray.array3d(screen)
+
+    # Assert that frames reuse the same surfaces and come out the same
+    first = frame((300, 200))
+    buffer, ambient = compositor.buffer, compositor.ambient
+    assert (frame((300, 200)) == first).all()
+    assert compositor.buffer is buffer and compositor.ambient is ambient
+    assert buffer.get_size() == (150, 100)
+
+    # Assert that the ambient light darkens the screen and lights brighten it
+    assert first[250, 150].max() < 100
+    assert first[60, 60].min() > first[250, 150].max()
+
+    # Assert that the surfaces are only reallocated when the screen size changes
+    frame((301, 200))
+    assert compositor.buffer is not buffer
+    assert compositor.buffer.get_size() == (151, 100)
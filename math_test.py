@@ -1,6 +1,17 @@
+import threading
+import time
+import numpy as np
 from pygame import Rect
-from src.lib.node import Node, neighbors
-from src.math.a_star import algorithm, get_closest_node
+from src.lib.node import Node, NodeView, neighbors
+from src.math.a_star import algorithm, get_closest_node, heuristic, node_layout, search, steps, SearchContext
+from src.math import jps
+from src.math.hpa import Hierarchy
+from src.math.d_star_lite import DStarLite
+from src.math.smoothing import line_of_sight, smooth_path
+from src.math.flow_field import FlowField
+from src.lib.navmesh import Navmesh, build_nodes, nearest_walkable, update_nearest, rasterize, adjacency
+from src.lib.path_service import PathService
+from src.lib.path_scheduler import PathScheduler
 
 def print_grid_with_path(nodes, path):
     for col in nodes:
@@ -16,6 +27,26 @@ def print_grid_with_path(nodes, path):
                 print(".", end=" ")
         print()
 
+def walled_grid():
+    """A 10x10 walkable grid with a wall down the middle, open only at the bottom row."""
+    walkable = np.ones((10, 10), dtype=bool)
+    walkable[0:9, 5] = False
+    return walkable
+
+class Tilemap:
+    """A stand-in for a TiledMap with the same collidable rects in every layer. Its file is only
+    written when a path is given, since the navmesh only reads it to key its cache."""
+    def __init__(self, rects: list[Rect], path=None, contents: str = ""):
+        self.filename = str(path)
+        self.rects = rects
+
+        if path is not None:
+            with open(path, "w") as file:
+                file.write(contents)
+
+    def get_rects_in_layer(self, layer):
+        return self.rects
+
 # Test neighbors
 def test_neighbors():
     # Create a 2D array of rects
@@ -38,6 +69,37 @@ def test_neighbors():
     # Assert that the middle node has 8 neighbors
     assert len(nodes[5][5].neighbors) == 8
 
+# Test the array-backed node grid
+def test_node_grid():
+    # Create a walkable grid with one blocked cell
+    walkable = np.ones((10, 10), dtype=bool)
+    walkable[5][4] = False
+
+    flags = adjacency(walkable)
+    grid = build_nodes(walkable, flags, 10)
+    nodes = grid.rows()
+
+    # Assert that the views match the nodes they stand in for
+    assert nodes[5][5] == Node(Rect(50, 50, 10, 10))
+    assert nodes[5][5].get(Rect) == Rect(50, 50, 10, 10)
+    assert not nodes[5][4].active
+    assert len(nodes[0][0].neighbors) == 3
+    assert len(nodes[5][5].neighbors) == 7
+    assert nodes[5][4] not in nodes[5][5].neighbors
+
+    # Assert that views of the same cell are equal and hash like the node they stand in for
+    assert grid.node(55) == nodes[5][5] and grid.node(55) is not nodes[5][5]
+    assert hash(grid.node(55)) == hash(Node(Rect(50, 50, 10, 10)))
+    assert len({grid.node(55), Node(Rect(50, 50, 10, 10))}) == 1
+    assert len({grid.node(55), nodes[5][5], grid.node(56)}) == 2
+
+    # Assert that neighbors are relinked after the adjacency changes
+    walkable[5][4] = True
+    flags[:] = adjacency(walkable)
+    grid.invalidate()
+    assert len(nodes[5][5].neighbors) == 8
+    assert isinstance(nodes[5][5].neighbors[0], NodeView)
+
 # Test get_closest_node
 def test_get_closest_node():
     # Create a 2D array of rects
@@ -55,6 +117,29 @@ def test_get_closest_node():
     # Assert that the closest node is the first node in the 2D array
     assert closest_node == nodes[0][0]
 
+# Test snapping positions to the same nodes as get_closest_node
+def test_node_layout():
+    rng = np.random.default_rng(0)
+    nodes = [[Node(Rect(x * 10 + 5, y * 10 + 3, 10, 10), rng.random() >= 0.4) for x in range(8)] for y in range(6)]
+    layout = node_layout(nodes)
+
+    # Assert that every position snaps to the closest walkable node, ties included
+    for pos in [(int(x), int(y)) for x, y in rng.integers(-20, 120, (200, 2))]:
+        assert layout.cells[layout.cell_id(pos, layout.walkable())] is get_closest_node(nodes, pos)
+
+# Test that algorithm sees nodes blocked between calls on the same grid
+def test_astar_blocked_between_calls():
+    nodes = [[Node(Rect(x * 10, y * 10, 10, 10)) for x in range(5)] for y in range(5)]
+    assert len(algorithm(nodes, (0, 20), (40, 20))) == 5
+
+    # Build a wall down the middle, open only at the bottom row
+    for y in range(4):
+        nodes[y][2].active = False
+
+    # Assert that the next path goes around the wall instead of through it
+    path = algorithm(nodes, (0, 20), (40, 20))
+    assert all(node.active for node in path) and nodes[4][2] in path
+
 # Test A* pathfinding
 def test_astar():
     # Create a 2D array of rects
@@ -103,3 +188,460 @@ def test_astar():
 
     # Assert that the path is the correct length
     assert len(path) == 18
+
+# Test the array-backed search engine
+def test_search():
+    walkable = walled_grid()
+
+    # Search from the top left to the top right corner
+    path = search(walkable, 0, 9)
+
+    # Assert that the path goes around the bottom of the wall
+    assert path[0] == 0
+    assert path[-1] == 9
+    assert 9 * 10 + 5 in path
+
+    # Assert that a blocked target has no path
+    assert search(walkable, 0, 5) == []
+
+# Test the shared flow field
+def test_flow_field():
+    walkable = walled_grid()
+
+    field = FlowField(walkable, 10, 9)
+
+    # Follow the field from the top left corner
+    cell = 0
+    path = [cell]
+    while cell != 9:
+        cell = field.next_cell(cell)
+        path.append(cell)
+
+    # Assert that the field path is as short as the A* path
+    assert len(path) == len(search(walkable, 0, 9))
+
+    # Assert that a world position snaps onto its cell
+    assert field.cell_at((15, 25)) == 21
+
+# Test the nearest walkable cell table
+def test_nearest_walkable():
+    # Create a walkable grid with a blocked 3x3 block in the corner
+    walkable = np.ones((10, 10), dtype=bool)
+    walkable[0:3, 0:3] = False
+
+    nearest = nearest_walkable(walkable)
+
+    # Assert that walkable cells map to themselves
+    assert nearest[55] == 55
+
+    # Assert that blocked cells map to the closest walkable cell
+    assert nearest[1] == 3
+    assert nearest[2 * 10 + 2] in (2 * 10 + 3, 3 * 10 + 2, 3 * 10 + 3)
+
+    # Assert that a fully blocked grid has no walkable cells
+    assert (nearest_walkable(np.zeros((3, 3), dtype=bool)) == -1).all()
+
+# Test the path request service
+def test_path_service():
+    class Target:
+        hp = 100
+        nodes = None
+
+        def set_nodes(self, nodes):
+            self.nodes = nodes
+
+    # Hold the worker on its first request so later requests stay pending
+    started = threading.Event()
+    release = threading.Event()
+    solved = []
+
+    def solve(enemy, start, target):
+        started.set()
+        release.wait(1)
+        solved.append(start)
+        return [start]
+
+    service = PathService(solve, workers=1)
+    blocker = Target()
+    enemy = Target()
+
+    service.request(blocker, (0, 0), (0, 0))
+    started.wait(1)
+
+    # Assert that repeated requests for an enemy are merged into the latest one
+    service.request(enemy, (1, 1), (0, 0))
+    service.request(enemy, (2, 2), (0, 0))
+    assert service.pending() == 1
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while enemy.nodes is None:
+        assert time.monotonic() < deadline, "path service never answered"
+        time.sleep(0.01)
+        service.poll()
+    service.shutdown()
+
+    # Assert that only the latest request was solved and handed back
+    assert solved == [(0, 0), (2, 2)]
+    assert enemy.nodes == [(2, 2)]
+
+# Test cancelling a request a worker has already started on
+def test_path_service_cancel():
+    class Target:
+        hp = 100
+        nodes = None
+
+        def set_nodes(self, nodes):
+            self.nodes = nodes
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def solve(enemy, start, target):
+        started.set()
+        release.wait(1)
+        return [start]
+
+    service = PathService(solve, workers=1)
+    enemy = Target()
+
+    service.request(enemy, (1, 1), (0, 0))
+    started.wait(1)
+    service.cancel(enemy)
+    release.set()
+
+    # Assert that the cancelled result is dropped but the next request is still answered
+    service.request(enemy, (2, 2), (0, 0))
+    deadline = time.monotonic() + 5
+    while enemy.nodes is None:
+        assert time.monotonic() < deadline, "path service never answered"
+        time.sleep(0.01)
+        service.poll()
+    service.shutdown()
+
+    assert enemy.nodes == [(2, 2)]
+
+# Test pausing and resuming a search
+def test_search_steps():
+    walkable = np.ones((20, 20), dtype=bool)
+    walkable[10, :18] = False
+
+    # Assert that a search paused every few expansions finds the same path as a full search
+    search_steps = steps(walkable, 0, 399, chunk=5)
+    pauses = 0
+    try:
+        while True:
+            next(search_steps)
+            pauses += 1
+    except StopIteration as done:
+        path = done.value
+
+    assert pauses > 1
+    assert path == search(walkable, 0, 399)
+
+# Test time-sliced path requests
+def test_path_scheduler():
+    class Target:
+        hp = 100
+        nodes = []
+
+        def set_nodes(self, nodes):
+            self.nodes = nodes
+
+    def solve(enemy, start, target):
+        # A search that needs three slices to finish
+        for _ in range(2):
+            yield
+        return [start]
+
+    near, far, dead = Target(), Target(), Target()
+    scheduler = PathScheduler(solve, budget_ms=1000)
+
+    scheduler.request(far, (2, 2), (0, 0), (False, 10))
+    scheduler.request(near, (1, 1), (0, 0), (False, 1))
+    scheduler.request(dead, (3, 3), (0, 0), (False, 0))
+    scheduler.request(near, (4, 4), (0, 0), (False, 1))
+    scheduler.forget(dead)
+    assert scheduler.pending() == 2
+
+    # Assert that a zero budget suspends the search and a later frame finishes it
+    scheduler.budget_ms = 0
+    scheduler.run()
+    assert near.nodes == [] and far.nodes == []
+
+    scheduler.budget_ms = 1000
+    scheduler.run()
+    assert near.nodes == [(4, 4)]
+    assert far.nodes == [(2, 2)]
+    assert dead.nodes == []
+    assert scheduler.stats()["queue_depth"] == 0
+    assert scheduler.stats()["completed"] == 2
+
+# Test reusing search contexts between queries
+def test_search_context():
+    # Create a walkable grid with a wall down the middle and one without
+    walled = walled_grid()
+    open_grid = np.ones((10, 10), dtype=bool)
+
+    # Assert that a reused context gives the same paths as a fresh one
+    context = SearchContext(100)
+    assert search(walled, 0, 9, context) == search(walled, 0, 9, SearchContext(100))
+    assert search(open_grid, 0, 9, context) == list(range(10))
+    assert search(walled, 0, 9, context) == search(walled, 0, 9)
+
+    # Assert that queries running on many threads at once agree
+    expected = search(walled, 0, 9)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(search(walled, 0, 9))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [expected] * 8
+
+# Test rasterizing barriers into the walkability grid
+def test_rasterize():
+    # Create rects of varying sizes, including ones that only touch cell edges
+    rects = [Rect(0, 0, 64, 64), Rect(100, 40, 10, 90), Rect(150, 150, 64, 64), Rect(300, 300, 0, 10)]
+
+    blocked = rasterize(rects, (200, 160), 32)
+
+    # Assert that each cell is blocked exactly when a rect collides with it
+    for y in range(blocked.shape[0]):
+        for x in range(blocked.shape[1]):
+            cell = Rect(x * 32, y * 32, 32, 32)
+            assert blocked[y][x] == any(rect.colliderect(cell) for rect in rects)
+
+# Test neighbor flags derived from the walkability grid
+def test_adjacency():
+    walkable = np.ones((10, 10), dtype=bool)
+    walkable[5][4] = False
+
+    flags = adjacency(walkable)
+
+    # Assert that corners, edges and blocked neighbors are accounted for
+    assert flags[0][0].sum() == 3
+    assert flags[9][9].sum() == 3
+    assert flags[5][5].sum() == 7
+
+# Test caching the navmesh on disk
+def test_navmesh_cache(tmp_path):
+    tilemap = Tilemap([Rect(0, 0, 64, 64)], tmp_path / "map.tmx", "first")
+
+    # Assert that the first load generates the navmesh and caches it
+    first = Navmesh((320, 320), 32, tilemap, ("Barriers",), str(tmp_path))
+    assert len(list(tmp_path.glob("*.npy"))) == 1
+
+    # Assert that the next load reads the cache instead of the tilemap
+    tilemap.rects = []
+    cached = Navmesh((320, 320), 32, tilemap, ("Barriers",), str(tmp_path))
+    assert (cached.walkable == first.walkable).all()
+    assert (cached.adjacency == first.adjacency).all()
+    assert not cached.walkable[0][0]
+    assert cached.closest_cell((16, 16)) == first.closest_cell((16, 16)) in (2, 20)
+
+    # Assert that changing the map file invalidates the cache
+    with open(tilemap.filename, "w") as file:
+        file.write("second")
+    changed = Navmesh((320, 320), 32, tilemap, ("Barriers",), str(tmp_path))
+    assert changed.walkable.all()
+
+# Test blocking cells and changing their costs at runtime
+def test_navmesh_dynamic(tmp_path):
+    tilemap = Tilemap([], tmp_path / "map.tmx", "open")
+
+    # Load the navmesh twice so that the second one is memory-mapped from the cache
+    Navmesh((320, 320), 32, tilemap, ("Barriers",), str(tmp_path))
+    navmesh = Navmesh((320, 320), 32, tilemap, ("Barriers",), str(tmp_path))
+    changes = []
+    navmesh.add_listener(changes.append)
+
+    # Assert that blocking a wall updates the adjacency and nodes around it only
+    wall = [row * 10 + 5 for row in range(9)]
+    navmesh.set_blocked(wall)
+    assert (navmesh.adjacency == adjacency(navmesh.walkable)).all()
+    assert not navmesh.node_at(5).active
+    assert navmesh.nodes is navmesh.nodes and not navmesh.nodes[0][5].active
+    assert navmesh.node_at(5) not in navmesh.node_at(4).neighbors
+    assert changes == [set(wall)]
+
+    # Assert that paths go around the wall and the cached file is left untouched
+    path = navmesh.find_path((16, 16), (304, 16))
+    assert all(navmesh.cell_id(node) not in wall for node in path)
+    assert navmesh.path_crosses(path, {95})
+    assert not navmesh.path_crosses(path, {70})
+    assert navmesh.closest_cell((176, 16)) in (4, 6)
+    reloaded = Navmesh((320, 320), 32, tilemap, ("Barriers",), str(tmp_path))
+    assert reloaded.walkable.all() and reloaded.closest_cell((176, 16)) == 5
+
+    # Assert that a costly gap in the wall is avoided and unblocking it notifies listeners
+    navmesh.set_blocked([85], False)
+    assert len(navmesh.find_path((16, 16), (304, 16))) < len(path)
+    navmesh.set_costs({85: 50.0})
+    assert all(navmesh.cell_id(node) != 85 for node in navmesh.find_path((16, 16), (304, 16)))
+    assert changes[-2:] == [{85}, {85}]
+
+# Test repairing the navmesh tables around changed cells instead of rebuilding them
+def test_navmesh_updates():
+    rng = np.random.default_rng(0)
+    walkable = rng.random((40, 40)) >= 0.3
+
+    nearest = nearest_walkable(walkable)
+    jumps = jps.JumpTable(walkable)
+    hierarchy = Hierarchy(walkable, 8)
+
+    for blocked in (True, False):
+        cells = [cell for cell in rng.choice(walkable.size, 10, replace=False).tolist() if walkable.flat[cell] == blocked]
+        walkable.flat[cells] = not blocked
+
+        update_nearest(nearest, walkable, cells)
+        jumps.update(walkable, cells)
+        hierarchy.update(cells)
+
+        # Assert that every nearest cell is walkable and as close as in a rebuilt table
+        rebuilt = nearest_walkable(walkable)
+        assert walkable.flat[nearest].all()
+        for cell in range(walkable.size):
+            distance = heuristic(*divmod(cell, 40), *divmod(int(nearest[cell]), 40))
+            assert abs(distance - heuristic(*divmod(cell, 40), *divmod(int(rebuilt[cell]), 40))) < 1e-9
+
+        # Assert that the jump table and abstract graph match rebuilt ones
+        assert all((getattr(jumps, side) == getattr(jps.JumpTable(walkable), side)).all() for side in ("east", "west", "south", "north"))
+        assert hierarchy.graph.keys() == Hierarchy(walkable, 8).graph.keys()
+        assert hierarchy.search(0, 40 * 40 - 1) == Hierarchy(walkable, 8).search(0, 40 * 40 - 1)
+
+# Test answering many path queries with one search
+def test_find_paths():
+    navmesh = Navmesh((320, 320), 32, Tilemap([Rect(160, 0, 32, 288)]), ("Barriers",), None)
+    positions = [(16, 16), (20, 20), (16, 200), (250, 250)]
+    stats = {}
+    paths = navmesh.find_paths(positions, (304, 16), stats=stats)
+
+    # Assert that positions in the same cell share one group but get their own lists
+    assert stats == {"groups": 3, "searches": 1}
+    assert paths[0] == paths[1] and paths[0] is not paths[1]
+
+    # Assert that the reverse search finds paths as short as separate searches
+    for pos, path in zip(positions, paths):
+        expected = navmesh.find_path(pos, (304, 16), "a_star")
+        assert path[0] == expected[0] and path[-1] == expected[-1]
+        assert len(path) == len(expected)
+
+# Test leaving the snapped start cell out of the waypoints an agent follows
+def test_smooth_from_blocked_start():
+    navmesh = Navmesh((320, 320), 32, Tilemap([Rect(160, 0, 32, 288)]), ("Barriers",), None)
+
+    # Stand inside the bottom end of the wall, so the start is snapped out of it beside the corner
+    start = navmesh.closest_cell((176, 280))
+    assert not navmesh.walkable[8][5] and start != navmesh.cell_at((176, 280))
+
+    path = navmesh.find_path((176, 280), (304, 16))
+    waypoints = navmesh.smooth(path, keep_start=False)
+
+    # Assert that the first waypoint is past the start cell, and that the rest match the full smoothing
+    assert navmesh.cell_id(waypoints[0]) != start
+    assert waypoints == navmesh.smooth(path)[1:]
+    assert navmesh.find_paths([(176, 280)], (304, 16), smooth=True, keep_start=False) == [waypoints]
+
+# Test Jump Point Search against A*
+def test_jps():
+    walkable = walled_grid()
+
+    a_star_stats = {}
+    jps_stats = {}
+    a_star_path = search(walkable, 0, 9, stats=a_star_stats)
+    jps_path = jps.search(walkable, 0, 9, stats=jps_stats)
+
+    # Assert that the jump points expand to a path as short as the A* path
+    assert jps_path[0] == 0
+    assert jps_path[-1] == 9
+    assert len(jps.expand(jps_path, 10)) == len(a_star_path)
+
+    # Assert that fewer cells were expanded
+    assert jps_stats["expansions"] < a_star_stats["expansions"]
+
+# Test that the navmesh hands the same kind of path to smoothing with JPS as with A*
+def test_navmesh_jps():
+    navmesh = Navmesh((100, 100), 10, Tilemap([Rect(50, 0, 10, 90)]), ("Barriers",), None)
+    assert (navmesh.walkable == walled_grid()).all()
+
+    a_star_path = navmesh.search(0, 9, "a_star")
+    jps_path = navmesh.search(0, 9, "jps")
+
+    # Assert that the jump points are filled in to a path as long as the A* one, with the same corners
+    assert len(jps_path) == len(a_star_path)
+    assert navmesh.smooth(navmesh.find_path((5, 5), (95, 5), "jps")) == navmesh.smooth(navmesh.find_path((5, 5), (95, 5), "a_star"))
+
+# Test hierarchical pathfinding
+def test_hpa():
+    # Create a walkable grid of walls with gaps, crossing several clusters
+    walkable = np.ones((40, 40), dtype=bool)
+    walkable[10, 0:38] = False
+    walkable[25, 2:40] = False
+
+    hierarchy = Hierarchy(walkable, 8)
+    path = hierarchy.search(0, 40 * 40 - 1)
+
+    # Assert that the path is a connected run of walkable cells between the ends
+    assert path[0] == 0
+    assert path[-1] == 40 * 40 - 1
+    assert all(walkable.ravel()[cell] for cell in path)
+    assert all(max(abs(a // 40 - b // 40), abs(a % 40 - b % 40)) == 1 for a, b in zip(path, path[1:]))
+
+    # Assert that a partly refined path keeps the same ends with fewer waypoints
+    partial = hierarchy.search(0, 40 * 40 - 1, refine=1)
+    assert partial[0] == 0
+    assert partial[-1] == 40 * 40 - 1
+    assert len(partial) < len(path)
+
+# Test incremental replanning as the target moves
+def test_d_star_lite():
+    walkable = walled_grid()
+
+    planner = DStarLite(walkable)
+    path = planner.plan(0, 9)
+
+    # Assert that the first plan is as short as the A* path
+    assert path[0] == 0
+    assert path[-1] == 9
+    assert len(path) == len(search(walkable, 0, 9))
+
+    # Assert that replanning while standing still does no new work
+    expansions = planner.expansions
+    assert planner.plan(0, 9) == path
+    assert planner.expansions == expansions
+
+    # Assert that moving along the path and moving the target reuses the search
+    path = planner.plan(path[1], 19)
+    assert path[-1] == 19
+    assert planner.resets == 1
+
+    # Assert that a weighted planner repairs its search to match A* after costs change
+    costs = np.ones((10, 10))
+    planner = DStarLite(walkable, costs)
+    planner.plan(0, 9)
+    costs[1:5, 0] = 5.0
+    planner.update_cells([10, 20, 30, 40])
+
+    def weighted_cost(path):
+        return sum(np.hypot(*np.subtract(divmod(a, 10), divmod(b, 10))) * costs.flat[b] for a, b in zip(path, path[1:]))
+
+    assert abs(weighted_cost(planner.plan(0, 9)) - weighted_cost(search(walkable, 0, 9, costs=costs))) < 1e-9
+
+# Test line of sight and path smoothing
+def test_smoothing():
+    walkable = walled_grid()
+
+    # Assert that lines are blocked by the wall but not along it
+    assert line_of_sight(walkable, 0, 4)
+    assert not line_of_sight(walkable, 0, 9)
+    assert line_of_sight(walkable, 90, 99)
+
+    path = search(walkable, 0, 9)
+    smoothed = smooth_path(walkable, path)
+
+    # Assert that the smoothed path keeps its ends and drops the cells in between corners
+    assert smoothed[0] == path[0]
+    assert smoothed[-1] == path[-1]
+    assert len(smoothed) < len(path)
+    assert set(smoothed) <= set(path)
@@ -2,14 +2,14 @@ import pygame
 import json
 import random
 
-import threading
 from pygame.math import Vector2
 from pygame import mixer
 
 import src.lighting.lighting as lighting
 import src.lib.tilemap as tilemap
-import src.math.a_star as a_star
 from src.lib.navmesh import Navmesh
+from src.lib.path_service import PathService
+from src.lib.path_scheduler import PathScheduler
 
 from screens.screen_base import ScreenBase
 from screens.end_screens import GameOver, LevelClear
@@ -24,11 +24,21 @@ from src.entity.enemy import Enemy
 from src.entity.spider import Spider
 from src.entity.turret import Turret
 
-# Create the shaders
-player_light_shader = lighting.pixel_shader(500, (255, 245, 182), 1, False)
-fire_shader = lighting.pixel_shader(500, (235, 89, 40), 0.75, False)
-heart_shader = lighting.pixel_shader(500, (255, 0, 0), 0.5, False)
-arctium_shader = lighting.pixel_shader(500, (9, 171, 235), 0.5, False)
+# Ways enemies can find their paths, and the searches the per-enemy ones can use
+PATHFINDING_MODES = ("flow_field", "workers", "sliced", "batched")
+PATH_ALGORITHMS = ("a_star", "jps", "hpa", "d_star_lite")
+
+# Extra cost of moving through a cell for every enemy standing in it
+CROWD_COST = 2.0
+
+# How many times smaller than the screen lights are accumulated before being scaled up
+LIGHT_SCALE = 2
+
+# Shader parameters as (size, color, intensity, point), built the first time a light uses them
+PLAYER_LIGHT_SHADER = (500, (255, 245, 182), 1, False)
+FIRE_SHADER = (500, (235, 89, 40), 0.75, False)
+HEART_SHADER = (500, (255, 0, 0), 0.5, False)
+ARCTIUM_SHADER = (500, (9, 171, 235), 0.5, False)
 
 class WorldScreen(ScreenBase):
     def __init__(self, world: str = "ruinMap"):
@@ -179,25 +189,79 @@ class WorldScreen(ScreenBase):
         self.tilemap = tilemap.TiledMap(world_data["tilemap"])
         self.barriers = self.tilemap.get_rects_in_layer("Barriers")
 
+        # Barriers merged into whole walls and bucketed by position, so each light only gathers
+        # the walls in its radius and casts one shadow per wall
+        self.occluders = lighting.OccluderIndex(lighting.merge_rects(self.barriers))
+
         self.navmesh = Navmesh(
             (self.tilemap.width, self.tilemap.height), 32, self.tilemap, ("Barriers",)
         )
 
+        # Pathfinding mode, either one shared "flow_field", a path per enemy from "workers" threads,
+        # "sliced" paths searched on the main thread within a per-frame time budget, or
+        # "batched" paths for every enemy from one search per replan
+        self.pathfinding = world_data.get("pathfinding", "flow_field")
+        if self.pathfinding not in PATHFINDING_MODES:
+            raise ValueError(f"Unknown pathfinding mode {self.pathfinding!r}, expected one of {PATHFINDING_MODES}")
+        self.navmesh.algorithm = world_data.get("path_algorithm", "a_star")
+        if self.navmesh.algorithm not in PATH_ALGORITHMS:
+            raise ValueError(f"Unknown path algorithm {self.navmesh.algorithm!r}, expected one of {PATH_ALGORITHMS}")
+        self.flow_field = None
+
+        # Incremental planners that keep their search between replans, one per enemy
+        self.planners = {}
+
+        # Turrets and the chest can't be walked through, and crowded cells cost more to path through
+        blocked = self.navmesh.cells_in(self.chest.get_rect())
+        for turret in self.turrets:
+            blocked += self.navmesh.cells_in(turret.get_hitbox())
+        self.navmesh.set_blocked(blocked)
+        self.crowd_cost = world_data.get("crowd_cost", CROWD_COST)
+        self.crowded: set[int] = set()
+        self.navmesh.add_listener(self.on_navmesh_change)
+
+        # Worker pool answering per-enemy path requests
+        self.path_service = None
+        if self.pathfinding == "workers":
+            self.path_service = PathService(self.find_enemy_path)
+
+        # Enemies waiting for the next batched search
+        self.batch: list[Enemy] = []
+
+        # Time-sliced searches resumed across frames
+        self.path_scheduler = None
+        if self.pathfinding == "sliced":
+            self.path_scheduler = PathScheduler(self.enemy_path_steps, world_data.get("path_budget_ms", 2.0))
+
         # Fire objects
         self.fire: list[pygame.Rect] = self.tilemap.get_rects_in_layer("Fire")
         self.fire_lights: list[lighting.Light] = []
 
-        # Setting lighting for objects
-        self.player_light = lighting.Light(500, player_light_shader)
+        # Lighting engine, either a shadow per occluder or "visibility" polygons from an angular sweep
+        self.light_type = lighting.VisibilityLight if world_data.get("lighting") == "visibility" else lighting.Light
+        self.light_scale = world_data.get("light_scale", LIGHT_SCALE)
+        self.lighting = lighting.LightingCompositor(50, self.light_scale)
+
+        # Setting lighting for objects, only the player light moves so the others are baked once
+        self.player_light = self.light_type(
+            500,
+            lighting.shaders.get(*PLAYER_LIGHT_SHADER),
+            cache_size=world_data.get("light_cache_size", lighting.LIGHT_CACHE_SIZE),
+            cache_grid=world_data.get("light_cache_grid", lighting.LIGHT_CACHE_GRID),
+            scale=self.light_scale,
+        )
 
         for i in range(0, len(self.fire)):
-            self.fire_lights.append(lighting.Light(500, fire_shader))
+            self.fire_lights.append(self.light_type(500, lighting.shaders.get(*FIRE_SHADER), static=True, scale=self.light_scale))
+            self.fire_lights[i].bake(self.occluders, self.fire[i].centerx, self.fire[i].centery)
 
         for heart in self.hearts:
-            heart.set_light(lighting.Light(500, heart_shader))
+            heart.set_light(self.light_type(500, lighting.shaders.get(*HEART_SHADER), static=True, scale=self.light_scale))
+            heart.get_light().bake(self.occluders, heart.x, heart.y)
 
         for arctium in self.arctium:
-            arctium.set_light(lighting.Light(500, arctium_shader))
+            arctium.set_light(self.light_type(500, lighting.shaders.get(*ARCTIUM_SHADER), static=True, scale=self.light_scale))
+            arctium.get_light().bake(self.occluders, arctium.x, arctium.y)
 
         # Sound effects
         self.crawler_sound = pygame.mixer.Sound("assets/sounds/effects/crawler_death.wav")
@@ -252,6 +316,17 @@ class WorldScreen(ScreenBase):
         # Update Cursor position
         ui_elements.Cursor.getInstance().update()
 
+        # Build the shared flow field once per replan
+        replan = self.navmesh.should_update()
+        if replan and self.crowd_cost > 0:
+            self.update_crowd_costs()
+        if replan and self.pathfinding == "flow_field":
+            self.flow_field = self.navmesh.flow_field(self.player.get(Transform).pos)
+
+        # Hand finished paths back to their enemies
+        if self.path_service is not None:
+            self.path_service.poll()
+
         for enemy in self.enemies:
             # Remove dead enemies
             if enemy.hp <= 0:
@@ -261,6 +336,11 @@ class WorldScreen(ScreenBase):
                 else:
                     pygame.mixer.Sound.play(self.crawler_sound)
                 self.enemies.remove(enemy)
+                if self.path_service is not None:
+                    self.path_service.forget(enemy)
+                if self.path_scheduler is not None:
+                    self.path_scheduler.forget(enemy)
+                self.planners.pop(enemy, None)
                 
                 # Drop ammunition
                 self.ammo.append(
@@ -276,13 +356,19 @@ class WorldScreen(ScreenBase):
                 self.player.kills += 1 
             else:
                 # Update pathfinding for alive enemies
-                if self.navmesh.should_update():
-                    threading.Thread(
-                        target=self.update_enemy_nodes, args=(enemy,)
-                    ).start()
+                if replan:
+                    self.update_enemy_path(enemy)
 
                 enemy.update()
 
+        # Answer every enemy queued this frame with one search
+        if self.batch:
+            self.find_batched_paths()
+
+        # Spend this frame's pathfinding budget
+        if self.path_scheduler is not None:
+            self.path_scheduler.run()
+
         # Check for collected items to determine which to render
         if self.pistol.collected == True:
             self.render_pistol = False
@@ -403,18 +489,97 @@ class WorldScreen(ScreenBase):
         
         # Setting lighting for newly spawned crystals
         temp = item.Item(position.x, position.y, self.arctium_img)
-        temp.set_light(lighting.Light(500, arctium_shader))
+        temp.set_light(self.light_type(500, lighting.shaders.get(*ARCTIUM_SHADER), static=True, scale=self.light_scale))
+        temp.get_light().bake(self.occluders, temp.x, temp.y)
         self.arctium.append(temp)
 
-    # Updating pathfinding for enemies
-    def update_enemy_nodes(self, enemy: Enemy):
-        enemy.set_nodes(
-            a_star.algorithm(
-                self.navmesh.nodes,
-                enemy.get(Transform).pos,
-                self.player.get(Transform).pos,
+    # Pointing an enemy at the player, directly or through the current pathfinding mode
+    def update_enemy_path(self, enemy: Enemy):
+        # Chase the player directly when nothing is in the way
+        if self.navmesh.line_of_sight(enemy.get(Transform).pos, self.player.get(Transform).pos):
+            # Searches still running for the enemy would overwrite the direct chase when they finish
+            if self.path_service is not None:
+                self.path_service.cancel(enemy)
+            if self.path_scheduler is not None:
+                self.path_scheduler.forget(enemy)
+            if enemy in self.batch:
+                self.batch.remove(enemy)
+            enemy.set_flow_field(None)
+            enemy.set_nodes([self.navmesh.closest_node(self.player.get(Transform).pos)])
+        elif self.pathfinding == "flow_field":
+            enemy.set_flow_field(self.flow_field)
+        elif self.pathfinding == "batched":
+            self.batch.append(enemy)
+        elif self.path_scheduler is not None:
+            # Enemies without a path go first, then the ones closest to the player
+            self.path_scheduler.request(
+                enemy, enemy.get(Transform).pos, self.player.get(Transform).pos,
+                (len(enemy.get_nodes()) > 0, enemy.get(Transform).pos.distance_to(self.player.get(Transform).pos)),
             )
+        else:
+            # Planners are only made and dropped on the main thread, the workers just look them up
+            if self.navmesh.algorithm == "d_star_lite" and enemy not in self.planners:
+                self.planners[enemy] = self.navmesh.planner()
+            self.path_service.request(
+                enemy, enemy.get(Transform).pos, self.player.get(Transform).pos
+            )
+
+    # Finding paths for every queued enemy with one shared search
+    def find_batched_paths(self):
+        paths = self.navmesh.find_paths(
+            [enemy.get(Transform).pos for enemy in self.batch], self.player.get(Transform).pos, smooth=True, keep_start=False
         )
+        for enemy, path in zip(self.batch, paths):
+            if enemy.hp > 0:
+                enemy.set_nodes(path)
+        self.batch = []
+
+    # Raising the cost of cells with enemies in them, so others path around crowds
+    def update_crowd_costs(self):
+        crowd = {}
+        for enemy in self.enemies:
+            if enemy.hp > 0:
+                cell = self.navmesh.cell_at(enemy.get(Transform).pos)
+                crowd[cell] = crowd.get(cell, 1.0) + self.crowd_cost
+
+        # Cells that emptied out go back to the normal cost
+        costs = {cell: 1.0 for cell in self.crowded if cell not in crowd}
+        costs.update(crowd)
+        self.crowded = set(crowd)
+        self.navmesh.set_costs(costs)
+
+    # Repairing plans after cells of the navmesh were blocked or changed cost
+    def on_navmesh_change(self, cells: set[int]):
+        for planner in list(self.planners.values()):
+            planner.update_cells(cells)
+
+        # Every enemy replans on this frame anyway
+        if self.navmesh.should_update() or self.pathfinding == "flow_field":
+            return
+
+        # Only enemies whose path runs through the changed cells need a new one
+        for enemy in self.enemies:
+            if enemy.hp > 0 and self.navmesh.path_crosses(enemy.get_nodes(), cells):
+                self.update_enemy_path(enemy)
+
+    # Finding a path for an enemy, called from the path service workers
+    def find_enemy_path(self, enemy: Enemy, start, target):
+        if self.navmesh.algorithm == "d_star_lite":
+            # The planner is gone when the enemy died after asking for a path
+            planner = self.planners.get(enemy)
+            if planner is None:
+                return []
+            path = self.navmesh.replan(planner, start, target)
+        else:
+            path = self.navmesh.find_path(start, target)
+
+        # Keep only the corners of the path, past the cell the enemy was snapped to
+        return self.navmesh.smooth(path, keep_start=False)
+
+    # Finding a path for an enemy a few expansions at a time, resumed by the path scheduler
+    def enemy_path_steps(self, enemy: Enemy, start, target):
+        path = yield from self.navmesh.find_path_steps(start, target)
+        return self.navmesh.smooth(path, keep_start=False)
 
     def render(self, screen: pygame.Surface):
         screen.fill((0, 0, 0))
@@ -455,29 +620,29 @@ class WorldScreen(ScreenBase):
         self.px = self.player_pos[0]
         self.py = self.player_pos[1]
 
-        # Render the light
-        lights_display = pygame.Surface((screen.get_size()))
-        lights_display.blit(lighting.global_light(screen.get_size(), 50), (0, 0))
+        # Render the light into a buffer light_scale times smaller than the screen
+        lights_display = self.lighting.begin(screen.get_size())
 
         for i in range(0, len(self.fire)):
             self.fire_lights[i].main(
-                self.barriers,
+                self.occluders,
                 lights_display,
                 self.fire[i].centerx,
                 self.fire[i].centery,
             )
 
         for heart in self.hearts:
-            heart.get_light().main(self.barriers, lights_display, heart.x, heart.y)
+            heart.get_light().main(self.occluders, lights_display, heart.x, heart.y)
 
         for arctium in self.arctium:
             arctium.get_light().main(
-                self.barriers, lights_display, arctium.x, arctium.y
+                self.occluders, lights_display, arctium.x, arctium.y
             )
 
-        self.player_light.main(self.barriers, lights_display, self.px, self.py)
+        self.player_light.main(self.occluders, lights_display, self.px, self.py)
 
-        screen.blit(lights_display, (0, 0), special_flags=pygame.BLEND_RGB_MULT)
+        # Scale the lighting up once, since it's smooth it loses little detail
+        self.lighting.composite(screen)
 
         # Render the HUD
         ui_elements.HUD.getInstance().render(screen)
@@ -486,4 +651,8 @@ class WorldScreen(ScreenBase):
         ui_elements.Cursor.getInstance().render(screen)
 
     def switch_to_scene(self, next_scene):
+        # Stop the path workers when leaving the world
+        if self.path_service is not None and next_scene is not self:
+            self.path_service.shutdown()
+            self.path_service = None
         self.next = next_scene
\ No newline at end of file
@@ -2,6 +2,7 @@ from pygame import image, Rect
 from pygame.math import Vector2
 
 from src.lib.node import Node
+from src.math.flow_field import FlowField
 from src.lib.transform import Transform
 from src.entity.character import Character
 
@@ -21,6 +22,7 @@ class Enemy(Character):
         self.damage = 20
         self.direction = Vector2(0,0)
         self.__nodes: list[Node] = []
+        self.__flow_field: FlowField = None
         self.is_spider = is_spider
     
     # Method called from weapon classes to damage enemy
@@ -33,16 +35,32 @@ class Enemy(Character):
     def set_nodes(self, nodes):
         self.__nodes = nodes
 
+    # Follow a shared flow field instead of a path of nodes
+    def get_flow_field(self):
+        return self.__flow_field
+    def set_flow_field(self, flow_field):
+        self.__flow_field = flow_field
+
+    # Move towards a position at the enemy's speed
+    def move_towards(self, target: Vector2):
+        self.direction: Vector2 = target - self.get(Transform).pos
+        if self.direction.length() == 0:
+            self.direction = Vector2(0,0)
+        else:
+            self.direction = self.direction.normalize()
+        self.move(self.direction * self.speed)
+
     # Pathfinding movement
     def update(self):
-        if len(self.__nodes) > 0:
+        if self.__flow_field is not None:
+            # Read the next step from the flow field
+            next_position = self.__flow_field.next_position(self.get(Transform).pos)
+            if next_position is not None:
+                self.move_towards(next_position)
+
+        elif len(self.__nodes) > 0:
             current_node_vector = Vector2(self.__nodes[0].get(Rect).centerx, self.__nodes[0].get(Rect).centery)
-            self.direction: Vector2 = current_node_vector - self.get(Transform).pos
-            if self.direction.length() == 0:
-                self.direction = Vector2(0,0)
-            else:
-                self.direction = self.direction.normalize()
-            self.move(self.direction * self.speed)
+            self.move_towards(current_node_vector)
 
             # Remove node if reached
             if self.get(Transform).pos.distance_to(current_node_vector) < 32:
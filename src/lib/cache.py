@@ -0,0 +1,27 @@
+import os
+from typing import Callable
+
+import numpy as np
+
+def load_or_build(path: str | None, build: Callable[[], np.ndarray], mmap_mode: str = None) -> np.ndarray:
+    """Load an array from a .npy cache file, building and caching it if it's missing or unreadable.
+    No file is read or written when the path is None."""
+    if path is not None:
+        try:
+            return np.load(path, mmap_mode=mmap_mode)
+        except (OSError, ValueError):
+            pass
+
+    array = build()
+
+    # Write to a temporary file first so a partial cache is never read
+    if path is not None:
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path + ".tmp", "wb") as file:
+                np.save(file, array)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+    return array
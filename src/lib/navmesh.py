@@ -1,24 +1,295 @@
+import hashlib
+import heapq
+import math
+import os
+from typing import Callable, Iterable
+import numpy as np
 import pygame
 
+from src.lib.cache import load_or_build
 from src.lib.tilemap import TiledMap
-from src.lib.node import Node, neighbors
+from src.lib.node import NodeGrid, NodeView
+from src.math import a_star, jps
+from src.math.hpa import Hierarchy
+from src.math.d_star_lite import DStarLite
+from src.math.smoothing import line_of_sight, path_crosses, smooth_path
+from src.math.flow_field import FlowField, integrate, trace
+
+# Directory that generated navmeshes are cached in
+CACHE_DIR = "cache/navmesh"
+
+# Bumped whenever the layout of the cache files changes
+CACHE_VERSION = 2
+
+# Byte order and size of the nearest walkable cell table in the cache
+NEAREST_DTYPE = np.dtype("<i4")
+
+# Abstract path segments the "hpa" algorithm refines into cells, the rest stay coarse waypoints
+HPA_REFINE = 2
 
 class Navmesh:
-    def __init__(self, size: tuple[int, int], tile_size: int, tilemap: TiledMap, collidable_layers: tuple[str]):
+    def __init__(self, size: tuple[int, int], tile_size: int, tilemap: TiledMap, collidable_layers: tuple[str], cache_dir: str | None = CACHE_DIR):
         self.size = size
         self.tile_size = tile_size
-        self.__nodes = self.generate(tilemap, collidable_layers)
+        self.algorithm = "a_star"
         self.__time = 0
 
-        # Generate the neighbors for each node
-        for i in range(len(self.__nodes)):
-            for j in range(len(self.__nodes[i])):
-                self.__nodes[i][j].neighbors = neighbors(self.__nodes, i, j)
+        # Walkability grid used by the search engine, the walkable neighbors of each cell and
+        # the nearest walkable cell of each cell, stored as one (13, rows, cols) byte array so
+        # that all of them can be memory-mapped from the cache
+        grid = np.asarray(self.load(tilemap, collidable_layers, cache_dir))
+        self.__walkable = grid[0].view(bool)
+        self.__adjacency = grid[1:9].view(bool).transpose(1, 2, 0)
+
+        # Node views are created on demand from this grid, rather than kept as one object per cell
+        self.__grid = self.build_nodes()
+        self.__rows: list[list[NodeView]] = None
+
+        # Lookup table from every cell to its nearest walkable cell, kept as the bytes of the last four planes
+        self.__nearest = grid[9:].reshape(-1).view(NEAREST_DTYPE)
+
+        # Jump Point Search table and HPA* hierarchy, built the first time they're needed
+        self.__jumps: jps.JumpTable = None
+        self.__hierarchy: Hierarchy = None
+
+        # Traversal cost of every cell for congestion, and the cells whose cost isn't 1
+        self.__costs = np.ones(self.__walkable.shape)
+        self.__weighted: set[int] = set()
+
+        # Called with the changed cells whenever walkability or costs change
+        self.__listeners: list[Callable[[set[int]], None]] = []
+
+    @property
+    def nodes(self) -> list[list[NodeView]]:
+        """A 2D list of node views, built once since views read the grid as it changes."""
+        if self.__rows is None:
+            self.__rows = self.__grid.rows()
+        return self.__rows
+
+    @property
+    def grid(self) -> NodeGrid:
+        return self.__grid
+
+    @property
+    def walkable(self) -> np.ndarray:
+        return self.__walkable
+
+    @property
+    def adjacency(self) -> np.ndarray:
+        return self.__adjacency
 
     @property
-    def nodes(self):
-        return self.__nodes 
+    def costs(self) -> np.ndarray:
+        return self.__costs
+
+    def weights(self) -> np.ndarray | None:
+        """Get the costs grid for searches, or None while every cell costs the same."""
+        return self.__costs if self.__weighted else None
+
+    def cell_id(self, node: NodeView) -> int:
+        """Get the cell id of a node in the navmesh."""
+        return (node.y // self.tile_size) * self.__walkable.shape[1] + node.x // self.tile_size
+
+    def node_at(self, cell: int) -> NodeView:
+        """Get the node with the given cell id."""
+        return self.__grid.node(cell)
+
+    def cell_at(self, pos: tuple[int, int]) -> int:
+        """Get the cell id under a world position, clamped to the navmesh."""
+        rows, cols = self.__walkable.shape
+        row = min(max(int(pos[1]) // self.tile_size, 0), rows - 1)
+        col = min(max(int(pos[0]) // self.tile_size, 0), cols - 1)
+        return row * cols + col
+
+    def closest_cell(self, pos: tuple[int, int]) -> int:
+        """Get the walkable cell id closest to a world position, or -1 if there is none."""
+        return int(self.__nearest[self.cell_at(pos)])
+
+    def closest_node(self, pos: tuple[int, int]) -> NodeView | None:
+        """Get the walkable node closest to a world position."""
+        cell = self.closest_cell(pos)
+        return self.__grid.node(cell) if cell >= 0 else None
+
+    def find_path(self, current_pos: tuple[int, int], target_pos: tuple[int, int], algorithm: str = None) -> list[NodeView]:
+        """Find a path of nodes between two world positions, using the navmesh's algorithm unless one is given."""
+        current_cell = self.closest_cell(current_pos)
+        target_cell = self.closest_cell(target_pos)
+
+        if current_cell < 0 or target_cell < 0:
+            return []
+
+        return self.__grid.nodes(self.search(current_cell, target_cell, algorithm))
+
+    def find_paths(self, positions: list[tuple[int, int]], target_pos: tuple[int, int], smooth: bool = False, keep_start: bool = True, stats: dict = None) -> list[list[NodeView]]:
+        """Find a path of nodes from each of many world positions to one target. Positions are
+        grouped by their start cell, and all groups are answered by a single search: a forward
+        search when there is one group, otherwise one reverse search from the target that stops
+        once every start cell is reached. Each position gets its own copy of its group's path."""
+        target_cell = self.closest_cell(target_pos)
+        starts = [self.closest_cell(pos) for pos in positions]
+        groups = {start for start in starts if start >= 0}
+        paths: dict[int, list[NodeView]] = {}
+
+        if target_cell >= 0 and len(groups) == 1:
+            start = groups.pop()
+            paths[start] = self.__grid.nodes(self.search(start, target_cell, "a_star"))
+
+        elif target_cell >= 0 and groups:
+            _, next_cell = integrate(self.__walkable, target_cell, self.weights(), groups)
+            for start in groups:
+                paths[start] = self.__grid.nodes(trace(next_cell, start))
+
+        if stats is not None:
+            stats["groups"] = len(paths)
+            stats["searches"] = 1 if paths else 0
+
+        # Smooth each group's path once rather than once per position
+        if smooth:
+            paths = {start: self.smooth(path, keep_start) for start, path in paths.items()}
+
+        return [list(paths.get(start, [])) for start in starts]
+
+    def find_path_steps(self, current_pos: tuple[int, int], target_pos: tuple[int, int], chunk: int = 32):
+        """Like find_path, but as a generator that pauses every chunk expansions so the search
+        can be resumed on a later frame. Always searches with A*, the path of nodes is the return value."""
+        current_cell = self.closest_cell(current_pos)
+        target_cell = self.closest_cell(target_pos)
+
+        if current_cell < 0 or target_cell < 0:
+            return []
+
+        path = yield from a_star.steps(self.__walkable, current_cell, target_cell, chunk=chunk, costs=self.weights())
+        return self.__grid.nodes(path)
+
+    def search(self, start: int, target: int, algorithm: str = None, stats: dict = None) -> list[int]:
+        """Find a path of cell ids with "a_star", "jps" or "hpa", using the navmesh's algorithm unless one is given.
+        Far away "hpa" paths end in coarse entrance waypoints, so they should be replanned as they're followed.
+        Only "a_star" weighs cell costs, the other two assume every walkable cell costs the same."""
+        algorithm = algorithm or self.algorithm
+
+        if algorithm == "jps":
+            if self.__jumps is None:
+                self.__jumps = jps.JumpTable(self.__walkable)
+            # Fill in the cells between jump points, so smoothing sees the same kind of path as with A*
+            return jps.expand(jps.search(self.__walkable, start, target, stats=stats, jumps=self.__jumps), self.__walkable.shape[1])
+
+        if algorithm == "hpa":
+            if self.__hierarchy is None:
+                self.__hierarchy = Hierarchy(self.__walkable)
+            return self.__hierarchy.search(start, target, refine=HPA_REFINE, stats=stats)
+
+        return a_star.search(self.__walkable, start, target, stats=stats, costs=self.weights())
+
+    def line_of_sight(self, a_pos: tuple[int, int], b_pos: tuple[int, int]) -> bool:
+        """Check whether the straight line between the cells of two world positions is clear of barriers."""
+        return line_of_sight(self.__walkable, self.cell_at(a_pos), self.cell_at(b_pos))
+
+    def smooth(self, nodes: list[NodeView], keep_start: bool = True) -> list[NodeView]:
+        """Reduce a path of nodes to the waypoints at its corners. Agents following the path should
+        leave out its start, the cell they were snapped to, or every replan pulls them back to it."""
+        waypoints = smooth_path(self.__walkable, [self.cell_id(node) for node in nodes])
+        if not keep_start and len(waypoints) > 1:
+            waypoints = waypoints[1:]
+        return self.__grid.nodes(waypoints)
+
+    def planner(self, weighted: bool = False) -> DStarLite:
+        """Create an incremental planner for one agent on this navmesh. Planners are rooted at
+        their agent, where congestion changes most, so they ignore cell costs unless weighted."""
+        return DStarLite(self.__walkable, self.__costs if weighted else None)
+
+    def replan(self, planner: DStarLite, current_pos: tuple[int, int], target_pos: tuple[int, int]) -> list[NodeView]:
+        """Find a path of nodes with an incremental planner, reusing its search from earlier calls."""
+        current_cell = self.closest_cell(current_pos)
+        target_cell = self.closest_cell(target_pos)
+
+        if current_cell < 0 or target_cell < 0:
+            return []
+
+        return self.__grid.nodes(planner.plan(current_cell, target_cell))
+
+    def flow_field(self, target_pos: tuple[int, int]) -> FlowField | None:
+        """Build a flow field towards a world position that every agent can share."""
+        target_cell = self.closest_cell(target_pos)
+
+        if target_cell < 0:
+            return None
+
+        return FlowField(self.__walkable, self.tile_size, target_cell, self.__nearest, self.weights())
     
+    def cells_in(self, rect: pygame.Rect) -> list[int]:
+        """Get the ids of the cells a rect overlaps."""
+        return np.flatnonzero(rasterize([rect], self.size, self.tile_size)).tolist()
+
+    def set_blocked(self, cells: Iterable[int], blocked: bool = True):
+        """Block or unblock cells, updating the adjacency, nearest cells, jump table and hierarchy
+        only around them. The node neighbors are relinked the next time they're needed."""
+        rows, cols = self.__walkable.shape
+        walkable = self.__walkable.ravel()
+        changed = {cell for cell in cells if walkable[cell] == blocked}
+
+        if not changed:
+            return
+
+        for cell in changed:
+            self.__walkable[divmod(cell, cols)] = not blocked
+
+        # Each neighbor of a changed cell has one adjacency flag pointing back at it
+        for cell in changed:
+            row, col = divmod(cell, cols)
+
+            for k, (dr, dc, _) in enumerate(a_star.NEIGHBORS):
+                r = row - dr
+                c = col - dc
+
+                if 0 <= r < rows and 0 <= c < cols:
+                    self.__adjacency[r, c, k] = not blocked
+
+        self.__grid.invalidate()
+        update_nearest(self.__nearest, self.__walkable, changed)
+
+        if self.__jumps is not None:
+            self.__jumps.update(self.__walkable, changed)
+        if self.__hierarchy is not None:
+            self.__hierarchy.update(changed)
+
+        self.notify(changed)
+
+    def set_costs(self, costs: dict[int, float]):
+        """Set the traversal cost of cells, which has to be at least 1."""
+        flat = self.__costs.ravel()
+        changed = set()
+
+        for cell, cost in costs.items():
+            if cost < 1:
+                raise ValueError(f"Cell {cell} can't cost less than 1, got {cost}")
+
+            if flat[cell] != cost:
+                flat[cell] = cost
+                changed.add(cell)
+
+            if cost == 1:
+                self.__weighted.discard(cell)
+            else:
+                self.__weighted.add(cell)
+
+        if changed:
+            self.notify(changed)
+
+    def add_listener(self, listener: Callable[[set[int]], None]):
+        """Call a function with the changed cell ids whenever walkability or costs change."""
+        self.__listeners.append(listener)
+
+    def notify(self, cells: set[int]):
+        for listener in self.__listeners:
+            listener(cells)
+
+    def path_crosses(self, nodes: list[NodeView], cells: set[int]) -> bool:
+        """Check whether a path of waypoints, followed in straight lines, passes through any of the cells."""
+        if not nodes:
+            return False
+
+        return path_crosses(self.__walkable.shape[1], [self.cell_id(node) for node in nodes], cells)
+
     # Calculate the next time the A* algorithm should be run
     def update(self):
         """Update the navmesh. This should be called once every 1000 ms."""
@@ -28,39 +299,190 @@ class Navmesh:
     def should_update(self) -> bool:
         return pygame.time.get_ticks() > self.__time
 
-    def generate(self, tilemap: TiledMap, layers: tuple[str]) -> list[list[Node]]:
-        """Generate a navmesh from a tilemap."""
-        navmesh: list[list[Node]] = []
+    def cache_key(self, tilemap: TiledMap, layers: tuple[str]) -> str:
+        """Hash everything the navmesh of a tilemap depends on."""
+        key = hashlib.sha1()
+        with open(tilemap.filename, "rb") as file:
+            key.update(file.read())
+        key.update(repr((CACHE_VERSION, tuple(layers), self.tile_size, tuple(self.size))).encode())
+        return key.hexdigest()
+
+    def load(self, tilemap: TiledMap, layers: tuple[str], cache_dir: str | None) -> np.ndarray:
+        """Load the navmesh grid from the cache, generating and caching it if it's missing."""
+        path = None if cache_dir is None else os.path.join(cache_dir, self.cache_key(tilemap, layers) + ".npy")
+
+        def build() -> np.ndarray:
+            walkable = self.generate(tilemap, layers)
+            nearest = nearest_walkable(walkable).astype(NEAREST_DTYPE).view(np.uint8).reshape(4, *walkable.shape)
+            grid = np.concatenate((walkable[None], adjacency(walkable).transpose(2, 0, 1))).view(np.uint8)
+            return np.ascontiguousarray(np.concatenate((grid, nearest)))
 
+        # Copy-on-write, so blocking cells at runtime never touches the cache file
+        return load_or_build(path, build, mmap_mode="c")
+
+    def generate(self, tilemap: TiledMap, layers: tuple[str]) -> np.ndarray:
+        """Generate the walkability grid of a navmesh from a tilemap."""
         # Find rectangles that are collidable
         rects = []
         for layer in layers:
             rects.extend(tilemap.get_rects_in_layer(layer))
 
-        for y in range(0, self.size[1], self.tile_size):
-            row = []
-            for x in range(0, self.size[0], self.tile_size):
-                rect = pygame.Rect(x, y, self.tile_size, self.tile_size)
-                active = True
-                for r in rects:
-                    if r.colliderect(rect):
-                        active = False
-                        break
-                row.append(Node(rect, active))
-            navmesh.append(row)
-
-        return navmesh
+        return ~rasterize(rects, self.size, self.tile_size)
+
+    def build_nodes(self) -> NodeGrid:
+        """Build the nodes of the navmesh from its walkability grid."""
+        return build_nodes(self.__walkable, self.__adjacency, self.tile_size)
     
     def debug_render(self, surface: pygame.Surface, color: tuple[int, int, int] = (255, 0, 0), active_color: tuple[int, int, int] = (0, 255, 0)):
         """Render the navmesh for debugging purposes."""
-        for row in self.__nodes:
-            for node in row:
-                if node.active:
-                    pygame.draw.rect(surface, active_color, node.get(pygame.Rect), 1)
-                else:
-                    pygame.draw.rect(surface, color, node.get(pygame.Rect), 1)
-
-    def debug_render_line_of_nodes(self, surface: pygame.Surface, nodes: list[Node], color: tuple[int, int, int] = (255, 0, 0)):
+        grid = self.__grid
+        for x, y, active in zip(grid.xs.tolist(), grid.ys.tolist(), grid.active.tolist()):
+            pygame.draw.rect(surface, active_color if active else color, (x, y, self.tile_size, self.tile_size), 1)
+
+    def debug_render_line_of_nodes(self, surface: pygame.Surface, nodes: list[NodeView], color: tuple[int, int, int] = (255, 0, 0)):
         """Render a line of nodes for debugging purposes."""
         for i in range(len(nodes) - 1):
             pygame.draw.line(surface, color, nodes[i].get(pygame.Rect).center, nodes[i + 1].get(pygame.Rect).center, 1)
+
+
+def build_nodes(walkable: np.ndarray, adjacency: np.ndarray, tile_size: int) -> NodeGrid:
+    """Build the node grid of a walkability grid, linking each cell to its walkable neighbors."""
+    grid = NodeGrid(walkable, adjacency, [(dr, dc) for dr, dc, _ in a_star.NEIGHBORS], tile_size)
+    grid.link()
+    return grid
+
+def nearest_walkable(walkable: np.ndarray) -> np.ndarray:
+    """Map every cell id to the id of its nearest walkable cell, or -1 if the grid has none.
+    Distances are octile, found with one forward and one backward pass over the rows,
+    which is enough because the shortest way between two cells can always be taken
+    as straight and diagonal steps in an order one of the passes follows."""
+    rows, cols = walkable.shape
+    distance = np.where(walkable, 0.0, np.inf)
+    nearest = np.where(walkable, np.arange(rows * cols, dtype=np.int32).reshape(rows, cols), np.int32(-1))
+    index = np.arange(cols)
+
+    def relax(row: int, other: int):
+        """Step into a row from the row above or below it."""
+        for dc, cost in ((0, 1.0), (-1, math.sqrt(2)), (1, math.sqrt(2))):
+            target = slice(max(dc, 0), cols + min(dc, 0))
+            source = slice(max(-dc, 0), cols + min(-dc, 0))
+            candidate = distance[other, source] + cost
+            closer = candidate < distance[row, target]
+            distance[row, target] = np.where(closer, candidate, distance[row, target])
+            nearest[row, target] = np.where(closer, nearest[other, source], nearest[row, target])
+
+    def sweep(row: int, step: int):
+        """Step along a row, left to right or right to left."""
+        d, n = distance[row, ::step], nearest[row, ::step]
+        offset = d - index
+        best = np.minimum.accumulate(offset)
+        source = np.maximum.accumulate(np.where(offset <= best, index, 0))
+        d[:] = best + index
+        n[:] = n[source]
+
+    for row in range(rows):
+        if row > 0:
+            relax(row, row - 1)
+        sweep(row, 1)
+
+    for row in range(rows - 1, -1, -1):
+        if row < rows - 1:
+            relax(row, row + 1)
+        sweep(row, -1)
+
+    return nearest.ravel()
+
+def update_nearest(nearest: np.ndarray, walkable: np.ndarray, cells: Iterable[int]):
+    """Repair a nearest_walkable table in place after some cells changed walkability. Only cells
+    whose nearest cell was blocked, and cells closer to a newly walkable cell, are searched again."""
+    rows, cols = walkable.shape
+    flat = walkable.ravel()
+    blocked = [cell for cell in cells if not flat[cell]]
+    opened = [cell for cell in cells if flat[cell]]
+
+    def distance(cell: int) -> float:
+        """Distance from a cell to its current nearest walkable cell."""
+        source = nearest[cell]
+        if source < 0:
+            return math.inf
+        return a_star.heuristic(*divmod(cell, cols), *divmod(int(source), cols))
+
+    def neighbors(cell: int):
+        row, col = divmod(cell, cols)
+        for dr, dc, cost in a_star.NEIGHBORS:
+            r = row + dr
+            c = col + dc
+            if 0 <= r < rows and 0 <= c < cols:
+                yield r * cols + c, cost
+
+    open_heap = []
+
+    # Cells that lost their nearest cell are searched again from the cells around them that didn't
+    if blocked:
+        lost = np.flatnonzero(np.isin(nearest, blocked))
+        nearest[lost] = -1
+        lost = set(lost.tolist())
+
+        for cell in lost:
+            for neighbor, _ in neighbors(cell):
+                if neighbor not in lost and nearest[neighbor] >= 0:
+                    open_heap.append((distance(neighbor), neighbor))
+
+    # Newly walkable cells are their own nearest cell, and grow outwards while they're closer
+    for cell in opened:
+        nearest[cell] = cell
+        open_heap.append((0.0, cell))
+
+    heapq.heapify(open_heap)
+
+    while open_heap:
+        current_distance, current = heapq.heappop(open_heap)
+
+        if current_distance > distance(current) + 1e-9:
+            continue
+
+        for neighbor, cost in neighbors(current):
+            new_distance = current_distance + cost
+
+            if new_distance < distance(neighbor) - 1e-9:
+                nearest[neighbor] = nearest[current]
+                heapq.heappush(open_heap, (new_distance, neighbor))
+
+
+def rasterize(rects: list[pygame.Rect], size: tuple[int, int], tile_size: int) -> np.ndarray:
+    """Mark every grid cell that overlaps one of the rects, in a single vectorized pass."""
+    rows = -(-size[1] // tile_size)
+    cols = -(-size[0] // tile_size)
+
+    boxes = np.array([(r.left, r.top, r.right, r.bottom) for r in rects if r.width > 0 and r.height > 0], dtype=np.int64).reshape(-1, 4)
+
+    # Range of cells covered by each rect, matching pygame.Rect.colliderect
+    c0 = np.clip(boxes[:, 0] // tile_size, 0, cols)
+    r0 = np.clip(boxes[:, 1] // tile_size, 0, rows)
+    c1 = np.clip(-(-boxes[:, 2] // tile_size), 0, cols)
+    r1 = np.clip(-(-boxes[:, 3] // tile_size), 0, rows)
+
+    inside = (c0 < c1) & (r0 < r1)
+    c0, r0, c1, r1 = c0[inside], r0[inside], c1[inside], r1[inside]
+
+    # Paint every box into a 2D difference array and integrate it
+    coverage = np.zeros((rows + 1, cols + 1), dtype=np.int32)
+    np.add.at(coverage, (r0, c0), 1)
+    np.add.at(coverage, (r0, c1), -1)
+    np.add.at(coverage, (r1, c0), -1)
+    np.add.at(coverage, (r1, c1), 1)
+
+    return coverage.cumsum(axis=0).cumsum(axis=1)[:rows, :cols] > 0
+
+def adjacency(walkable: np.ndarray) -> np.ndarray:
+    """Get a (rows, cols, 8) array flagging which of the a_star.NEIGHBORS of each cell are walkable."""
+    rows, cols = walkable.shape
+    padded = np.zeros((rows + 2, cols + 2), dtype=bool)
+    padded[1:-1, 1:-1] = walkable
+
+    result = np.empty((rows, cols, len(a_star.NEIGHBORS)), dtype=bool)
+
+    for k, (dr, dc, _) in enumerate(a_star.NEIGHBORS):
+        result[:, :, k] = padded[1 + dr:1 + dr + rows, 1 + dc:1 + dc + cols]
+
+    return result
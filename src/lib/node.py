@@ -3,7 +3,8 @@ import pygame
 from src.entity.entity import Entity
 
 class Node(Entity):
-    """A node is a point in the grid that can be connected to other nodes."""
+    """A node is a point in the grid that can be connected to other nodes.
+    Search state lives in a SearchContext, so nodes can be shared between queries."""
     def __init__(self, rect: pygame.Rect, active: bool = True):
         """Create a new node."""
         super().__init__(rect)
@@ -11,38 +12,131 @@ class Node(Entity):
         self.y = rect.y
         self.active = active
         self.neighbors: list[Node] = []
-        self.connection: Node = None
-        self.__g: float = 0.0
-        self.__h: float = 0.0
+    
+    def __hash__(self):
+        return hash((self.x, self.y))
 
-    def get_f(self):
-        """Get the f value of the node."""
-        return self.__g + self.__h
+    def __str__(self):
+        return f"Node({self.get(pygame.Rect).center}, {self.active})"
+    
+    def __eq__(self, other):
+        return self.get(pygame.Rect).center == other.get(pygame.Rect).center
 
-    def set_g(self, value: float):
-        """Set the g value of the node."""
-        self.__g = value
+    def __repr__(self):
+        return str(self)
 
-    def get_g(self):
-        """Get the g value of the node."""
-        return self.__g
 
-    def set_h(self, value: float):
-        """Set the h value of the node."""
-        self.__h = value
+class NodeGrid:
+    """Every cell of a navmesh stored as flat arrays indexed by cell id (row * cols + col).
+    Neighbors are kept in CSR form, the neighbors of a cell are indices[indptr[cell]:indptr[cell + 1]].
+    The walkability grid and adjacency flags are shared, not copied, so changes to them show up here
+    once invalidate is called."""
+    def __init__(self, walkable: np.ndarray, adjacency: np.ndarray, offsets: tuple[tuple[int, int], ...], tile_size: int):
+        """Create a grid from a 2D walkability grid and its (rows, cols, len(offsets)) neighbor flags."""
+        rows, cols = walkable.shape
+        cells = np.arange(rows * cols, dtype=np.int32)
+
+        self.shape = (rows, cols)
+        self.tile_size = tile_size
+        self.xs = (cells % cols) * np.int32(tile_size)
+        self.ys = (cells // cols) * np.int32(tile_size)
+        self.active = walkable.reshape(-1)
+
+        self.__adjacency = adjacency
+        self.__offsets = np.array([dr * cols + dc for dr, dc in offsets], dtype=np.int32)
+        self.__indptr: np.ndarray = None
+        self.__indices: np.ndarray = None
+
+    def __len__(self):
+        return self.active.size
+
+    @property
+    def indptr(self) -> np.ndarray:
+        if self.__indptr is None:
+            self.link()
+        return self.__indptr
+
+    @property
+    def indices(self) -> np.ndarray:
+        if self.__indices is None:
+            self.link()
+        return self.__indices
+
+    def link(self):
+        """Build the CSR neighbor arrays from the adjacency flags."""
+        rows, cols, _ = self.__adjacency.shape
+        row, col, k = np.nonzero(self.__adjacency)
+        cells = (row * cols + col).astype(np.int32)
+
+        indptr = np.zeros(rows * cols + 1, dtype=np.int32)
+        np.cumsum(np.bincount(cells, minlength=rows * cols), out=indptr[1:])
+
+        self.__indices = cells + self.__offsets[k]
+        self.__indptr = indptr
+
+    def invalidate(self):
+        """Drop the neighbor arrays after the adjacency flags change, they're rebuilt the next time they're needed."""
+        self.__indptr = None
+        self.__indices = None
+
+    def neighbors(self, cell: int) -> np.ndarray:
+        """Get the cell ids of the walkable neighbors of a cell."""
+        indptr = self.indptr
+        return self.indices[indptr[cell]:indptr[cell + 1]]
+
+    def node(self, cell: int) -> "NodeView":
+        return NodeView(self, cell)
+
+    def nodes(self, cells: list[int]) -> list["NodeView"]:
+        return [NodeView(self, cell) for cell in cells]
+
+    def rows(self) -> list[list["NodeView"]]:
+        """Get a 2D list of node views, for code that walks the grid like a 2D list of nodes."""
+        rows, cols = self.shape
+        return [[NodeView(self, row * cols + col) for col in range(cols)] for row in range(rows)]
+
+
+class NodeView:
+    """A lightweight stand-in for a Node that reads one cell of a NodeGrid.
+    Views of the same grid are equal when their cell ids are, and hash like a Node at the same position."""
+    __slots__ = ("grid", "cell")
+
+    def __init__(self, grid: NodeGrid, cell: int):
+        self.grid = grid
+        self.cell = cell
+
+    @property
+    def x(self) -> int:
+        return int(self.grid.xs[self.cell])
+
+    @property
+    def y(self) -> int:
+        return int(self.grid.ys[self.cell])
+
+    @property
+    def active(self) -> bool:
+        return bool(self.grid.active[self.cell])
+
+    @property
+    def neighbors(self) -> list["NodeView"]:
+        return self.grid.nodes(self.grid.neighbors(self.cell).tolist())
+
+    def get(self, component: type) -> pygame.Rect:
+        """Get the rect of the cell, the only component a view has."""
+        if component is not pygame.Rect:
+            raise KeyError(component)
+        return pygame.Rect(self.x, self.y, self.grid.tile_size, self.grid.tile_size)
 
-    def get_h(self):
-        """Get the h value of the node."""
-        return self.__h
-    
     def __hash__(self):
         return hash((self.x, self.y))
 
+    def __eq__(self, other):
+        if not isinstance(other, NodeView):
+            return NotImplemented
+        return self.cell == other.cell and self.grid is other.grid
+
     def __str__(self):
         return f"Node({self.get(pygame.Rect).center}, {self.active})"
-    
-    def __eq__(self, other):
-        return self.get(pygame.Rect).center == other.get(pygame.Rect).center
 
     def __repr__(self):
         return str(self)
@@ -0,0 +1,108 @@
+import heapq
+import time
+from collections import deque
+from typing import Callable, Generator
+
+from pygame.math import Vector2
+
+from src.lib.node import Node
+from src.entity.enemy import Enemy
+
+# Default time the scheduler may spend on searches each frame
+BUDGET_MS = 2.0
+
+class PathScheduler:
+    """Spreads enemy path searches across frames on the main thread.
+    Each frame, run() resumes searches until the frame's time budget is spent; a search that
+    doesn't finish is suspended and carries on next frame. Requests with the lowest priority
+    value are served first."""
+    def __init__(self, solve: Callable[[Enemy, tuple[float, float], tuple[float, float]], Generator[None, None, list[Node]]], budget_ms: float = BUDGET_MS):
+        self.solve = solve
+        self.budget_ms = budget_ms
+
+        # Heap of (priority, sequence, enemy), with entries dropped once a newer request replaces them
+        self.__queue: list[tuple[tuple, int, Enemy]] = []
+        self.__pending: dict[Enemy, tuple[int, tuple[float, float], tuple[float, float], float]] = {}
+        self.__sequence = 0
+
+        # The search currently in progress as (enemy, request time, generator)
+        self.__active: tuple[Enemy, float, Generator] | None = None
+
+        # Milliseconds from request to result for recent searches, and the time spent last frame
+        self.latencies: deque[float] = deque(maxlen=100)
+        self.frame_ms = 0.0
+        self.completed = 0
+
+    def request(self, enemy: Enemy, start: Vector2, target: Vector2, priority: tuple = (0,)):
+        """Queue a path request for an enemy, replacing any request it still has waiting.
+        A replaced request keeps its original request time, so latency counts the whole wait."""
+        self.__sequence += 1
+        requested = self.__pending[enemy][3] if enemy in self.__pending else time.perf_counter()
+
+        # Copy the positions since entities move them in place
+        self.__pending[enemy] = (self.__sequence, (start[0], start[1]), (target[0], target[1]), requested)
+        heapq.heappush(self.__queue, (priority, self.__sequence, enemy))
+
+    def pending(self) -> int:
+        """Get the number of searches waiting or in progress."""
+        return len(self.__pending) + (self.__active is not None)
+
+    def forget(self, enemy: Enemy):
+        """Stop tracking an enemy, such as when it dies."""
+        self.__pending.pop(enemy, None)
+
+        if self.__active is not None and self.__active[0] is enemy:
+            self.__active[2].close()
+            self.__active = None
+
+    def run(self):
+        """Work on queued searches until this frame's budget is spent, handing finished paths to their enemies."""
+        start = time.perf_counter()
+        deadline = start + self.budget_ms / 1000
+
+        while time.perf_counter() < deadline:
+            if self.__active is None and not self.__next():
+                break
+
+            enemy, requested, steps = self.__active
+
+            try:
+                next(steps)
+            except StopIteration as done:
+                self.__active = None
+                self.completed += 1
+                self.latencies.append((time.perf_counter() - requested) * 1000)
+
+                if enemy.hp > 0:
+                    enemy.set_nodes(done.value)
+
+        self.frame_ms = (time.perf_counter() - start) * 1000
+
+    def stats(self) -> dict:
+        """Get the queue depth and recent latencies in milliseconds, for tuning the budget."""
+        latencies = sorted(self.latencies)
+
+        return {
+            "queue_depth": self.pending(),
+            "completed": self.completed,
+            "frame_ms": self.frame_ms,
+            "latency_ms": sum(latencies) / len(latencies) if latencies else 0.0,
+            "latency_p95_ms": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] if latencies else 0.0,
+        }
+
+    def __next(self) -> bool:
+        """Start the most urgent waiting search, returning False if there are none."""
+        while self.__queue:
+            _, sequence, enemy = heapq.heappop(self.__queue)
+            request = self.__pending.get(enemy)
+
+            # Skip entries for forgotten enemies and requests that were replaced
+            if request is None or request[0] != sequence:
+                continue
+
+            del self.__pending[enemy]
+            _, start, target, requested = request
+            self.__active = (enemy, requested, self.solve(enemy, start, target))
+            return True
+
+        return False
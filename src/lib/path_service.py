@@ -0,0 +1,92 @@
+import queue
+import threading
+from typing import Callable
+
+from pygame.math import Vector2
+
+from src.lib.node import Node
+from src.entity.enemy import Enemy
+
+class PathService:
+    """Answers enemy path requests on a fixed pool of worker threads."""
+    def __init__(self, solve: Callable[[Enemy, tuple[float, float], tuple[float, float]], list[Node]], workers: int = 2):
+        self.solve = solve
+        self.__requests: queue.Queue = queue.Queue()
+        self.__results: queue.Queue = queue.Queue()
+        self.__lock = threading.Lock()
+
+        # Latest request waiting for each enemy, and the newest result applied to it
+        self.__pending: dict[Enemy, tuple[int, tuple[float, float], tuple[float, float]]] = {}
+        self.__applied: dict[Enemy, int] = {}
+        self.__sequence = 0
+
+        self.__workers = [threading.Thread(target=self.__work, daemon=True) for _ in range(workers)]
+        for worker in self.__workers:
+            worker.start()
+
+    def request(self, enemy: Enemy, start: Vector2, target: Vector2):
+        """Queue a path request for an enemy, replacing any request it still has waiting."""
+        with self.__lock:
+            self.__sequence += 1
+            queued = enemy in self.__pending
+
+            # Copy the positions since entities move them in place
+            self.__pending[enemy] = (self.__sequence, (start[0], start[1]), (target[0], target[1]))
+
+        if not queued:
+            self.__requests.put(enemy)
+
+    def pending(self) -> int:
+        """Get the number of enemies waiting for a path."""
+        with self.__lock:
+            return len(self.__pending)
+
+    def poll(self):
+        """Hand finished paths to their enemies. This should be called from the main thread."""
+        while True:
+            try:
+                enemy, sequence, path = self.__results.get_nowait()
+            except queue.Empty:
+                break
+
+            # Drop results for dead enemies and results that finished after a newer one
+            if enemy.hp <= 0 or sequence < self.__applied.get(enemy, 0):
+                continue
+
+            self.__applied[enemy] = sequence
+            enemy.set_nodes(path)
+
+    def cancel(self, enemy: Enemy):
+        """Drop an enemy's waiting request and ignore the results of any already being solved,
+        such as when it found its own way to the target. Later requests are answered as usual."""
+        with self.__lock:
+            self.__pending.pop(enemy, None)
+            self.__applied[enemy] = self.__sequence + 1
+
+    def forget(self, enemy: Enemy):
+        """Stop tracking an enemy, such as when it dies."""
+        with self.__lock:
+            self.__pending.pop(enemy, None)
+        self.__applied.pop(enemy, None)
+
+    def shutdown(self):
+        """Stop the worker threads once they finish their current request."""
+        for _ in self.__workers:
+            self.__requests.put(None)
+
+    def __work(self):
+        while True:
+            enemy = self.__requests.get()
+
+            if enemy is None:
+                break
+
+            with self.__lock:
+                request = self.__pending.pop(enemy, None)
+
+            # The enemy was forgotten while its request was waiting
+            if request is None:
+                continue
+
+            sequence, start, target = request
+            self.__results.put((enemy, sequence, self.solve(enemy, start, target)))
@@ -6,6 +6,7 @@ class TiledMap:
 
     def __init__(self, filename: str):
         tm = pytmx.load_pygame(filename, pixelalpha=True)
+        self.filename = filename
         self.width = tm.width * tm.tilewidth
         self.height = tm.height * tm.tileheight
         self.tile_width = tm.tilewidth
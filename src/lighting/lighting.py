@@ -2,21 +2,134 @@
 # Adapted by: Team 96
 
 import pygame
+import bisect
+import hashlib
 import math
+import os
+from collections import OrderedDict
 import numpy as np
 
 from pygame.locals import *
 
+from src.lib.cache import load_or_build
+
+# Directory that generated shaders are cached in
+CACHE_DIR = "cache/shaders"
+
+# Bumped whenever the shader output or the layout of the cache files changes
+CACHE_VERSION = 1
+
+# Width of the buckets occluders are indexed in
+BUCKET_SIZE = 128
+
+# Shadowed surfaces each moving light keeps, and the grid in pixels its position is snapped to
+LIGHT_CACHE_SIZE = 16
+LIGHT_CACHE_GRID = 2
+
+
+def merge_rects(rects: list[pygame.Rect]) -> list[pygame.Rect]:
+    """Merge rects that line up edge to edge into larger rects covering the same area, first along
+    rows and then along columns. A wall of tiles becomes one rect, so it casts one shadow."""
+    rows: list[pygame.Rect] = []
+
+    for rect in sorted({tuple(rect) for rect in rects}, key=lambda r: (r[1], r[3], r[0])):
+        rect = pygame.Rect(rect)
+        last = rows[-1] if rows else None
+
+        if last is not None and (last.y, last.height, last.right) == (rect.y, rect.height, rect.x):
+            last.width += rect.width
+        else:
+            rows.append(rect)
+
+    merged: list[pygame.Rect] = []
+
+    for rect in sorted(rows, key=lambda r: (r.x, r.width, r.y)):
+        last = merged[-1] if merged else None
+
+        if last is not None and (last.x, last.width, last.bottom) == (rect.x, rect.width, rect.y):
+            last.height += rect.height
+        else:
+            merged.append(rect)
+
+    return merged
+
+
+class OccluderIndex:
+    """A uniform grid of buckets over a map's occluder rects, so lights only look at the rects near them.
+    Each rect is listed in every bucket it touches. The version goes up whenever the rects change,
+    so lights know when their cached shadows are out of date."""
+    def __init__(self, rects: list[pygame.Rect], bucket_size: int = BUCKET_SIZE):
+        self.bucket_size = bucket_size
+        self.version = -1
+        self.set_rects(rects)
+
+    def set_rects(self, rects: list[pygame.Rect]):
+        """Replace the indexed rects."""
+        self.rects = list(rects)
+        self.buckets: dict[tuple[int, int], list[int]] = {}
+        self.version += 1
+
+        for i, rect in enumerate(self.rects):
+            for key in self.keys(rect.left, rect.top, rect.right, rect.bottom):
+                self.buckets.setdefault(key, []).append(i)
+
+    def __len__(self):
+        return len(self.rects)
+
+    def __iter__(self):
+        return iter(self.rects)
+
+    def keys(self, left: float, top: float, right: float, bottom: float):
+        """Get the keys of the buckets touched by a box, edges included."""
+        size = self.bucket_size
+        for bx in range(int(left // size), int(right // size) + 1):
+            for by in range(int(top // size), int(bottom // size) + 1):
+                yield bx, by
+
+    def query(self, left: float, top: float, right: float, bottom: float) -> list[pygame.Rect]:
+        """Get the rects in the buckets a box touches, in their original order. This can include
+        rects near the box that don't touch it, so callers still need their own overlap check."""
+        found = set()
+        for key in self.keys(left, top, right, bottom):
+            found.update(self.buckets.get(key, ()))
+
+        return [self.rects[i] for i in sorted(found)]
+
 
 class Light:
-    def __init__(self, size, pixel_shader):
+    def __init__(self, size, pixel_shader, static=False, cache_size=0, cache_grid=LIGHT_CACHE_GRID, scale=1):
         self.size = size
         self.radius = size * 0.5
-        self.render_surface = pygame.Surface((size, size))
+
+        # Shadows are worked out at full resolution, but drawn into surfaces scale times smaller,
+        # for a lighting buffer that is scale times smaller than the screen
+        self.scale = scale
+        if scale != 1:
+            pixel_shader = pygame.transform.smoothscale(pixel_shader, (round(size / scale),) * 2)
+
+        self.render_surface = pygame.Surface(pixel_shader.get_size())
         self.pixel_shader_surf = pixel_shader.copy()
         self.baked_pixel_shader_surf = pixel_shader.copy()
         self.render_surface.set_colorkey((0, 0, 0))
 
+        # Static lights cast their shadows once and blend the baked surface every frame after,
+        # until they're drawn somewhere else
+        self.static = static
+        self.baked_at = None
+
+        # Moving lights can keep their most recently used shadowed surfaces, keyed by their position
+        # snapped to the cache grid and the version of the occluders
+        self.cache_size = cache_size
+        self.cache_grid = cache_grid
+        self.cache: OrderedDict[tuple, pygame.Surface] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def bake(self, tiles, x, y):
+        """Cast the shadows of the light at a position into its baked surface."""
+        self.baked_lighting(tiles, x, y, True)
+        self.baked_at = (x, y)
+
     def baked_lighting(self, tiles, x, y, reset_surface):
         if reset_surface:
             self.baked_pixel_shader_surf = self.pixel_shader_surf.copy()
@@ -143,7 +256,18 @@ class Light:
                         points[3],
                     ]
 
-        pygame.draw.polygon(render_surface, (0, 0, 0), render_points)
+        pygame.draw.polygon(render_surface, (0, 0, 0), self.scaled(render_points))
+
+    def scaled(self, points):
+        """Scale points on the light from full resolution down to its surfaces."""
+        if self.scale == 1:
+            return points
+
+        return [(point[0] / self.scale, point[1] / self.scale) for point in points]
+
+    def position(self, x, y):
+        """Get where the light surface goes on a lighting buffer for a light at a position."""
+        return ((x - self.radius) / self.scale, (y - self.radius) / self.scale)
 
     def get_corners(self, points, x, y):
         corners = [points[0], points[2], points[2]]
@@ -175,6 +299,10 @@ class Light:
     def get_tiles(self, tiles, x, y):
         points = []
 
+        # Only look at the rects near the light's bounding square when they're indexed
+        if isinstance(tiles, OccluderIndex):
+            tiles = tiles.query(x - self.radius, y - self.radius, x + self.radius, y + self.radius)
+
         for rect in tiles:
             if (
                 rect.x - x >= (-self.radius) - rect.width and rect.x - x <= self.radius
@@ -198,7 +326,7 @@ class Light:
         for point in points:
             try:
                 color = self.pixel_shader_surf.get_at(
-                    (int(point[0] - dx), int(point[1] - dy))
+                    (int((point[0] - dx) / self.scale), int((point[1] - dy) / self.scale))
                 )
             except:
                 color = (0, 0, 0, 255)
@@ -208,14 +336,77 @@ class Light:
 
         return render
 
+    def check_reach(self, points, x, y):
+        """Check whether any part of a tile is within the light's radius. Unlike check_cast this
+        holds for large merged tiles whose corners are all out of reach."""
+        nearest_x = min(max(x, points[1][0]), points[3][0])
+        nearest_y = min(max(y, points[1][1]), points[3][1])
+
+        return (nearest_x - x) ** 2 + (nearest_y - y) ** 2 < self.radius ** 2
+
     def main(self, tiles, display, x, y):
+        if self.static:
+            if self.baked_at != (x, y):
+                self.bake(tiles, x, y)
+
+            display.blit(
+                self.baked_pixel_shader_surf,
+                self.position(x, y),
+                special_flags=BLEND_RGBA_ADD,
+            )
+
+            return display
+
+        if self.cache_size:
+            x = round(x / self.cache_grid) * self.cache_grid
+            y = round(y / self.cache_grid) * self.cache_grid
+            key = (x, y, getattr(tiles, "version", None))
+            surface = self.cache.get(key)
+
+            if surface is None:
+                self.misses += 1
+                surface = self.cast_shadows(tiles, x, y).copy()
+                self.cache[key] = surface
+
+                # Evict the least recently used surfaces
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+
+            else:
+                self.hits += 1
+                self.cache.move_to_end(key)
+
+        else:
+            surface = self.cast_shadows(tiles, x, y)
+
+        display.blit(
+            surface,
+            self.position(x, y),
+            special_flags=BLEND_RGBA_ADD,
+        )
+
+        return display
+
+    def stats(self) -> dict:
+        """Get the shadow cache counters, for tuning its size and grid."""
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.cache),
+        }
+
+    def cast_shadows(self, tiles, x, y) -> pygame.Surface:
+        """Draw the light at a position with the shadows of the tiles around it into its render surface."""
         self.render_surface.fill((0, 0, 0))
         self.render_surface.blit(self.baked_pixel_shader_surf, (0, 0))
 
         dx, dy = x - self.radius, y - self.radius
 
         for point in self.get_tiles(tiles, x, y):
-            if self.check_cast(point, dx, dy):
+            if self.check_reach(point, x, y):
                 corners = self.get_corners(point, x, y)
                 corners = [
                     [corners[0][0] - dx, corners[0][1] - dy],
@@ -234,13 +425,106 @@ class Light:
                     ],
                 )
 
-        display.blit(
-            self.render_surface,
-            (x - self.radius, y - self.radius),
-            special_flags=BLEND_RGBA_ADD,
-        )
+        return self.render_surface
 
-        return display
+
+
+class VisibilityLight(Light):
+    """A light that finds the area it can see with an angular sweep over the edges of the occluders
+    in its radius, and masks its pixel shader with that one polygon instead of drawing a shadow per tile."""
+    def visibility_polygon(self, tiles, x, y) -> list[tuple[float, float]]:
+        """Get the outline of the area visible from the light, in the light surface's coordinates."""
+        dx, dy = x - self.radius, y - self.radius
+
+        # Edges of the occluders in reach and of the light surface, as (x1, y1, x2, y2)
+        edges = [
+            [0, 0, self.size, 0],
+            [self.size, 0, self.size, self.size],
+            [self.size, self.size, 0, self.size],
+            [0, self.size, 0, 0],
+        ]
+
+        # Occluders are clipped to the light surface, so that every place an edge is cut off is an edge end.
+        # Only the edges facing the light can be seen, the ones behind them are always hidden
+        for point in self.get_tiles(tiles, x, y):
+            if self.check_reach(point, x, y):
+                left, top = max(point[1][0] - dx, 0), max(point[1][1] - dy, 0)
+                right, bottom = min(point[3][0] - dx, self.size), min(point[3][1] - dy, self.size)
+
+                if self.radius < top:
+                    edges.append([left, top, right, top])
+                if self.radius > bottom:
+                    edges.append([right, bottom, left, bottom])
+                if self.radius < left:
+                    edges.append([left, bottom, left, top])
+                if self.radius > right:
+                    edges.append([right, top, right, bottom])
+
+        # Edges relative to the light, turned so that each one runs counterclockwise around it.
+        # Edges in line with the light cover no angle and are left out
+        segments = []
+        for x1, y1, x2, y2 in edges:
+            x1, y1, x2, y2 = x1 - self.radius, y1 - self.radius, x2 - self.radius, y2 - self.radius
+            turn = x1 * y2 - y1 * x2
+            if turn < 0:
+                x1, y1, x2, y2 = x2, y2, x1, y1
+            if turn != 0:
+                segments.append((x1, y1, x2 - x1, y2 - y1))
+
+        def angle(px, py) -> float:
+            """Angle of a point around the light, in (-pi, pi]."""
+            theta = math.atan2(py, px)
+            return math.pi if theta <= -math.pi else theta
+
+        def distance(segment, theta) -> float:
+            """Distance from the light to the line of a segment along the ray at an angle."""
+            px, py, ex, ey = segment
+            return (px * ey - py * ex) / (math.cos(theta) * ey - math.sin(theta) * ex)
+
+        # Every segment starts and ends at the angles of its ends, segments that cross the
+        # angle the sweep starts at are already active when it begins
+        starts, ends = {}, {}
+        active = []
+        for index, (px, py, ex, ey) in enumerate(segments):
+            first, last = angle(px, py), angle(px + ex, py + ey)
+            starts.setdefault(first, []).append(index)
+            ends.setdefault(last, []).append(index)
+            if first > last:
+                active.append(index)
+
+        angles = sorted(starts.keys() | ends.keys())
+        gaps = [(theta + following) / 2 for theta, following in zip(angles, angles[1:] + [angles[0] + 2 * math.pi])]
+
+        # Active segments are kept ordered by distance along the sweep, which never changes
+        # while two of them are both active since occluder edges don't cross
+        active.sort(key=lambda index: distance(segments[index], (angles[0] - math.pi) / 2))
+
+        points = []
+        for theta, gap in zip(angles, gaps):
+            front = active[0]
+
+            for index in ends.get(theta, ()):
+                active.remove(index)
+            for index in starts.get(theta, ()):
+                bisect.insort(active, index, key=lambda index: distance(segments[index], gap))
+
+            # Whenever the nearest segment changes, the outline steps from the old one to the new one
+            if active[0] != front:
+                for index in (front, active[0]):
+                    reach = distance(segments[index], theta)
+                    points.append((self.radius + reach * math.cos(theta), self.radius + reach * math.sin(theta)))
+
+        return points
+
+    def cast_shadows(self, tiles, x, y) -> pygame.Surface:
+        self.render_surface.fill((0, 0, 0))
+        pygame.draw.polygon(self.render_surface, (255, 255, 255), self.scaled(self.visibility_polygon(tiles, x, y)))
+        self.render_surface.blit(self.pixel_shader_surf, (0, 0), special_flags=BLEND_RGB_MULT)
+
+        return self.render_surface
+
+    def baked_lighting(self, tiles, x, y, reset_surface):
+        self.baked_pixel_shader_surf = self.cast_shadows(tiles, x, y).copy()
 
 
 def global_light(size: tuple[int, int], intensity: int) -> pygame.Surface:
@@ -250,6 +534,46 @@ def global_light(size: tuple[int, int], intensity: int) -> pygame.Surface:
     return dark
 
 
+class LightingCompositor:
+    """Owns the surfaces lights are accumulated in each frame. They're allocated once and only
+    reallocated when the screen size changes, each frame just resets them."""
+    def __init__(self, intensity: int, scale: int = 1):
+        self.intensity = intensity
+        self.scale = scale
+        self.size = None
+        self.buffer: pygame.Surface = None
+        self.ambient: pygame.Surface = None
+        self.upscaled: pygame.Surface = None
+
+    def resize(self, size: tuple[int, int]):
+        """Allocate the surfaces for a screen size. The buffer is scale times smaller, rounded up."""
+        self.size = tuple(size)
+        buffer_size = (-(-size[0] // self.scale), -(-size[1] // self.scale))
+
+        self.buffer = pygame.Surface(buffer_size)
+        self.ambient = global_light(buffer_size, self.intensity)
+        self.upscaled = None
+        if self.scale != 1:
+            self.upscaled = pygame.Surface((buffer_size[0] * self.scale, buffer_size[1] * self.scale), 0, self.buffer)
+
+    def begin(self, size: tuple[int, int]) -> pygame.Surface:
+        """Reset the buffer to the ambient light for a new frame and return it for lights to be drawn into."""
+        if self.size != tuple(size):
+            self.resize(size)
+
+        self.buffer.fill((0, 0, 0))
+        self.buffer.blit(self.ambient, (0, 0))
+        return self.buffer
+
+    def composite(self, screen: pygame.Surface):
+        """Scale the buffer up to the screen and multiply the screen by it."""
+        result = self.buffer
+        if self.upscaled is not None:
+            result = pygame.transform.smoothscale(self.buffer, self.upscaled.get_size(), self.upscaled)
+
+        screen.blit(result, (0, 0), special_flags=BLEND_RGB_MULT)
+
+
 def pixel_shader(
     size: int,
     color: tuple[int, int, int],
@@ -259,37 +583,80 @@ def pixel_shader(
     angle_width=360,
 ) -> pygame.Surface:
     """Creates a pixel shader surface for use with pygame's BLEND_RGBA_MULT flag."""
+    return pygame.surfarray.make_surface(pixel_shader_array(size, color, intensity, point, angle, angle_width))
+
+
+def pixel_shader_array(
+    size: int,
+    color: tuple[int, int, int],
+    intensity: float,
+    point: bool,
+    angle=0,
+    angle_width=360,
+) -> np.ndarray:
+    """Creates the (size, size, 3) pixel array of a pixel shader, indexed [x][y]."""
     final_array = np.full((size, size, 3), color, dtype=np.uint16)
     radius = size * 0.5
 
-    for x in range(len(final_array)):
-        for y in range(len(final_array[x])):
-            # Radial -----
-            distance = math.sqrt((x - radius) ** 2 + (y - radius) ** 2)
+    # Pixel coordinates, indexed [x][y] like the surface array
+    x, y = np.indices((size, size), dtype=np.float64)
 
-            radial_falloff = (radius - distance) * (1 / radius)
+    # Radial -----
+    distance = np.sqrt((x - radius) ** 2 + (y - radius) ** 2)
 
-            if radial_falloff <= 0:
-                radial_falloff = 0
-            # -----
+    radial_falloff = np.maximum((radius - distance) * (1 / radius), 0)
+    # -----
 
-            # Angular -----
-            if not point:
-                angular_falloff = 1
+    # Angular -----
+    if not point:
+        angular_falloff = 1
 
-            else:
-                point_angle = (180 / math.pi) * -math.atan2(
-                    (radius - x), (radius - y)
-                ) + 180
-                diff_angle = abs(((angle - point_angle) + 180) % 360 - 180)
+    else:
+        point_angle = (180 / math.pi) * -np.arctan2((radius - x), (radius - y)) + 180
+        diff_angle = np.abs(((angle - point_angle) + 180) % 360 - 180)
+
+        angular_falloff = np.maximum(((angle_width / 2) - diff_angle) * (1 / angle_width), 0)
+    # -----
+
+    final_intensity = radial_falloff * angular_falloff * intensity
+    return (final_array * final_intensity[:, :, None]).astype(np.uint16)
+
+
+class ShaderRegistry:
+    """Builds pixel shaders the first time they're used and keeps them for the rest of the game.
+    Generated pixel arrays are also cached on disk, so later launches load them instead."""
+    def __init__(self, cache_dir: str | None = CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.__shaders: dict[tuple, pygame.Surface] = {}
+
+    def get(
+        self,
+        size: int,
+        color: tuple[int, int, int],
+        intensity: float,
+        point: bool,
+        angle=0,
+        angle_width=360,
+    ) -> pygame.Surface:
+        """Get the pixel shader surface for the given parameters, building it if needed."""
+        key = (size, tuple(color), intensity, point, angle, angle_width)
+        shader = self.__shaders.get(key)
+
+        if shader is None:
+            shader = pygame.surfarray.make_surface(self.load(key))
+            self.__shaders[key] = shader
+
+        return shader
 
-                angular_falloff = ((angle_width / 2) - diff_angle) * (1 / angle_width)
+    def cache_key(self, key: tuple) -> str:
+        """Hash the parameters of a shader."""
+        return hashlib.sha1(repr((CACHE_VERSION, key)).encode()).hexdigest()
 
-                if angular_falloff <= 0:
-                    angular_falloff = 0
-            # -----
+    def load(self, key: tuple) -> np.ndarray:
+        """Load the pixel array of a shader from the cache, generating and caching it if it's missing."""
+        path = None if self.cache_dir is None else os.path.join(self.cache_dir, self.cache_key(key) + ".npy")
+        return load_or_build(path, lambda: pixel_shader_array(*key))
 
-            final_intensity = radial_falloff * angular_falloff * intensity
-            final_array[x][y] = final_array[x][y] * final_intensity
 
-    return pygame.surfarray.make_surface(final_array)
+# Shared registry used by the game
+shaders = ShaderRegistry()
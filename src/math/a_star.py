@@ -1,73 +1,272 @@
+import heapq
+import math
+import threading
+from contextlib import contextmanager
 import numpy as np
 from src.lib.node import Node, get_closest_node
 
-def algorithm(
-    nodes: list[list[Node]],
-    current_pos: tuple[int, int],
-    target_pos: tuple[int, int],
-) -> list[Node]:
-    current_node = get_closest_node(nodes, current_pos)
-    target_node = get_closest_node(nodes, target_pos)
+# Offsets to the 8 neighbors of a cell as (row, col, cost)
+NEIGHBORS = (
+    (-1, -1, math.sqrt(2)),
+    (-1, 0, 1.0),
+    (-1, 1, math.sqrt(2)),
+    (0, -1, 1.0),
+    (0, 1, 1.0),
+    (1, -1, math.sqrt(2)),
+    (1, 0, 1.0),
+    (1, 1, math.sqrt(2)),
+)
 
-    # Clear the connections
-    for col in nodes:
-        for node in col:
-            node.connection = None
+def heuristic(row: int, col: int, target_row: int, target_col: int) -> float:
+    """Octile distance between two cells of an 8-connected grid."""
+    dr = abs(row - target_row)
+    dc = abs(col - target_col)
+    return (dr + dc) + (math.sqrt(2) - 2) * min(dr, dc)
 
-    # If the current node is the target node, return the current node
-    if current_node == target_node:
-        return [current_node]
+class SearchContext:
+    """Scratch state for searches over grids of a given size, reused between queries.
+    Entries are only valid when their stamp matches the current generation, so starting
+    a new query never has to reset the arrays."""
+    def __init__(self, size: int):
+        self.size = size
+        self.g = np.zeros(size)
+        self.parent = np.zeros(size, dtype=np.int64)
+        self.seen = np.zeros(size, dtype=np.uint32)
+        self.closed = np.zeros(size, dtype=np.uint32)
+        self.generation = 0
+
+    def begin(self) -> int:
+        """Start a new query and return its generation."""
+        self.generation += 1
+
+        # Wrap around before the stamps overflow
+        if self.generation == np.iinfo(np.uint32).max:
+            self.seen.fill(0)
+            self.closed.fill(0)
+            self.generation = 1
+
+        return self.generation
+
+    def reconstruct(self, target: int) -> list[int]:
+        """Follow the parent links back from the target cell."""
+        path = [target]
+
+        while self.parent[path[-1]] >= 0:
+            path.append(int(self.parent[path[-1]]))
+
+        return path[::-1]
+
+class SearchContextPool:
+    """A thread-safe pool of search contexts, so concurrent queries never share state."""
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__free: dict[int, list[SearchContext]] = {}
+
+    def acquire(self, size: int) -> SearchContext:
+        """Take a free context for grids of the given size, creating one if needed."""
+        with self.__lock:
+            free = self.__free.get(size)
+            if free:
+                return free.pop()
+
+        return SearchContext(size)
+
+    def release(self, context: SearchContext):
+        """Return a context to the pool."""
+        with self.__lock:
+            self.__free.setdefault(context.size, []).append(context)
+
+    @contextmanager
+    def context(self, size: int):
+        """Borrow a context for the duration of a with block."""
+        context = self.acquire(size)
+        try:
+            yield context
+        finally:
+            self.release(context)
+
+# Shared pool used when no context is given
+contexts = SearchContextPool()
+
+def search(walkable: np.ndarray, start: int, target: int, context: SearchContext = None, stats: dict = None, costs: np.ndarray = None) -> list[int]:
+    """Find a path of cell ids (row * cols + col) through a 2D walkability grid.
+    If a costs grid is given, moving into a cell costs that many times as much; costs must be at least 1.
+    If a stats dict is given, the number of expanded cells is stored in it."""
+    if context is None:
+        with contexts.context(walkable.size) as context:
+            return search(walkable, start, target, context, stats, costs)
+
+    # Without a chunk size the steps never pause, so the first step is the whole search
+    try:
+        next(steps(walkable, start, target, context, stats, costs=costs))
+    except StopIteration as done:
+        return done.value
+
+def steps(walkable: np.ndarray, start: int, target: int, context: SearchContext = None, stats: dict = None, chunk: int = 0, costs: np.ndarray = None):
+    """Run a search as a generator that pauses after every chunk expansions, so it can be
+    spread across frames. The path is the generator's return value. Without a context,
+    one is borrowed from the shared pool until the generator finishes or is closed."""
+    if context is None:
+        with contexts.context(walkable.size) as context:
+            return (yield from steps(walkable, start, target, context, stats, chunk, costs))
+
+    rows, cols = walkable.shape
+    cells = walkable.ravel()
+    weights = costs.ravel() if costs is not None else None
+
+    if not cells[start] or not cells[target]:
+        return []
+
+    if start == target:
+        return [start]
 
-    # Set the current node's g value to 0
-    current_node.set_g(0)
+    # Per-query state, indexed by cell id
+    generation = context.begin()
+    g = context.g
+    parent = context.parent
+    seen = context.seen
+    closed = context.closed
 
-    # Set the current node's h value to the distance between the current node and the target node
-    current_node.set_h(np.sqrt((current_node.x - target_node.x) ** 2 + (current_node.y - target_node.y) ** 2))
+    target_row, target_col = divmod(target, cols)
+    start_row, start_col = divmod(start, cols)
 
-    # Create a list of open nodes and a list of closed nodes
-    toSearch = set([current_node])
-    searched = set()
+    # Open set ordered by f, preferring deeper nodes on ties
+    g[start] = 0.0
+    parent[start] = -1
+    seen[start] = generation
+    open_heap = [(heuristic(start_row, start_col, target_row, target_col), 0.0, start)]
+    expansions = 0
+    pause = chunk
 
-    # Loop through the open nodes
-    while len(toSearch) > 0:
-        current_node = min(toSearch, key=lambda node: node.get_f())
+    while open_heap:
+        # Hand control back to the caller, the state above is kept until it resumes
+        if expansions == pause:
+            pause += chunk
+            if chunk:
+                yield expansions
 
-        if current_node == target_node:
-            path = [current_node]
+        _, neg_g, current = heapq.heappop(open_heap)
 
-            # Loop through the connections
-            while current_node.connection is not None:
-                # Add the connection to the path
-                path.append(current_node.connection)
+        # Skip stale entries left behind by a cheaper push
+        if closed[current] == generation:
+            continue
 
-                # Set the current node to the connection
-                current_node = current_node.connection
+        if current == target:
+            if stats is not None:
+                stats["expansions"] = expansions
+            return context.reconstruct(target)
 
-            # Reverse the path and return it
-            return path[::-1]
+        closed[current] = generation
+        expansions += 1
+        current_g = -neg_g
+        row, col = divmod(current, cols)
 
-        # Remove the current node from the open nodes list and add it to the closed nodes list
-        toSearch.remove(current_node)
-        searched.add(current_node)
+        for dr, dc, cost in NEIGHBORS:
+            r = row + dr
+            c = col + dc
 
-        for neighbor in current_node.neighbors:
-            in_search = neighbor in toSearch
+            if r < 0 or r >= rows or c < 0 or c >= cols:
+                continue
+
+            neighbor = r * cols + c
 
-            # If the neighbor is not active or the neighbor is in the closed nodes list, skip it
-            if not neighbor.active or neighbor in searched:
+            # If the neighbor is not walkable or already closed, skip it
+            if not cells[neighbor] or closed[neighbor] == generation:
                 continue
 
-            cost_dist = np.sqrt((neighbor.x - current_node.x) ** 2 + (neighbor.y - current_node.y) ** 2)
-            cost_to_neighbor = current_node.get_g() + cost_dist
+            cost_to_neighbor = current_g + (cost if weights is None else cost * weights[neighbor])
+
+            if seen[neighbor] != generation or cost_to_neighbor < g[neighbor]:
+                g[neighbor] = cost_to_neighbor
+                parent[neighbor] = current
+                seen[neighbor] = generation
+                f = cost_to_neighbor + heuristic(r, c, target_row, target_col)
+                heapq.heappush(open_heap, (f, -cost_to_neighbor, neighbor))
+
+    if stats is not None:
+        stats["expansions"] = expansions
+
+    return []
+
+class NodeLayout:
+    """The flattened cells of a 2D list of nodes laid out on a regular grid, so positions
+    snap to cells by division instead of a scan over every node. Only the layout is kept,
+    walkability is read from the nodes again whenever it's needed."""
+    def __init__(self, nodes: list[list[Node]]):
+        rows, cols = len(nodes), len(nodes[0])
+
+        self.nodes = nodes
+        self.cells = [node for row in nodes for node in row]
+        self.shape = (rows, cols)
+        self.origin = (nodes[0][0].x, nodes[0][0].y)
+        self.tile_size = nodes[0][1].x - nodes[0][0].x if cols > 1 else nodes[1][0].y - nodes[0][0].y if rows > 1 else 1
+
+        # Views of a NodeGrid can read their grid's walkability directly
+        grid = getattr(nodes[0][0], "grid", None)
+        self.grid = grid if grid is not None and grid.shape == self.shape else None
+
+    def walkable(self) -> np.ndarray:
+        """Read the current walkability of every node as a 2D grid."""
+        if self.grid is not None:
+            return self.grid.active.reshape(self.shape)
+        return np.fromiter((node.active for node in self.cells), dtype=bool, count=len(self.cells)).reshape(self.shape)
+
+    def cell_id(self, pos: tuple[int, int], walkable: np.ndarray) -> int:
+        """Get the cell id of the walkable node closest to a position, or -1 if none is walkable."""
+        rows, cols = self.shape
+        x, y = (pos[0] - self.origin[0]) / self.tile_size, (pos[1] - self.origin[1]) / self.tile_size
+
+        # Round halfway positions down, so ties go to the first node like get_closest_node
+        row = min(max(math.ceil(y - 0.5), 0), rows - 1)
+        col = min(max(math.ceil(x - 0.5), 0), cols - 1)
+        if walkable[row, col]:
+            return row * cols + col
+
+        walkable = np.flatnonzero(walkable)
+        if walkable.size == 0:
+            return -1
 
-            # If the neighbor is not in the open nodes list, set the neighbor's g value to the cost to the neighbor and add it to the open nodes list
-            if not in_search or cost_to_neighbor < neighbor.get_g():
-                neighbor.set_g(cost_to_neighbor)
-                neighbor.connection = current_node
+        xs = (walkable % cols) * self.tile_size + self.origin[0]
+        ys = (walkable // cols) * self.tile_size + self.origin[1]
+        distances = (xs - pos[0]) ** 2 + (ys - pos[1]) ** 2
+        return int(walkable[np.argmin(distances)])
+
+# Layouts of the node grids algorithm has been called with, keyed by the grid's id.
+# Only the most recent few are kept, since each one holds on to its grid
+LAYOUT_LIMIT = 8
+_layouts: dict[int, NodeLayout] = {}
+_layouts_lock = threading.Lock()
+
+def node_layout(nodes: list[list[Node]]) -> NodeLayout:
+    """Get the layout of a node grid, building it the first time the grid is seen."""
+    with _layouts_lock:
+        layout = _layouts.get(id(nodes))
+        if layout is None or layout.nodes is not nodes:
+            layout = _layouts[id(nodes)] = NodeLayout(nodes)
+            if len(_layouts) > LAYOUT_LIMIT:
+                del _layouts[next(iter(_layouts))]
+        return layout
+
+def algorithm(
+    nodes: list[list[Node]],
+    current_pos: tuple[int, int],
+    target_pos: tuple[int, int],
+) -> list[Node]:
+    if not nodes or not nodes[0]:
+        return []
+
+    layout = node_layout(nodes)
+    walkable = layout.walkable()
+    current_cell = layout.cell_id(current_pos, walkable)
+    target_cell = layout.cell_id(target_pos, walkable)
+
+    if current_cell < 0 or target_cell < 0:
+        return []
+
+    # If the current node is the target node, return the current node
+    if current_cell == target_cell:
+        return [layout.cells[current_cell]]
 
-                if not in_search:
-                    h_dist = np.sqrt((neighbor.x - target_node.x) ** 2 + (neighbor.y - target_node.y) ** 2)
-                    neighbor.set_h(h_dist)
-                    toSearch.add(neighbor)
+    path = search(walkable, current_cell, target_cell)
 
-    return []
\ No newline at end of file
+    return [layout.cells[i] for i in path]
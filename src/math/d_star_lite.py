@@ -0,0 +1,197 @@
+import heapq
+import math
+import threading
+import numpy as np
+
+from src.math.a_star import NEIGHBORS, heuristic
+
+# Keys are rounded to this many decimals, since the same key summed in a different order
+# can differ in its last bits and break the tie on the second entry
+KEY_DECIMALS = 6
+
+class DStarLite:
+    """An incremental planner (D* Lite) for one agent chasing a moving target.
+    The search is rooted at an anchor cell where the agent started planning, so distances
+    from the anchor stay valid while the target moves; each replan only extends the search
+    towards the target's new cell. As long as the agent stays on its planned path, the path
+    from its current cell is a suffix of the anchor's path. Once it leaves the path, the
+    planner re-anchors on the agent's cell and starts a fresh search.
+    Moving into a cell costs its entry in the optional costs grid times the move's length."""
+    def __init__(self, walkable: np.ndarray, costs: np.ndarray = None):
+        self.walkable = walkable
+        self.costs = costs
+        self.rows, self.cols = walkable.shape
+        self.__lock = threading.Lock()
+
+        # Cells that changed since the last plan, kept apart so marking them never waits on a plan
+        self.__changes_lock = threading.Lock()
+        self.__changed: set[int] = set()
+
+        self.anchor: int = -1
+        self.target: int = -1
+        self.previous: set[int] = set()
+
+        # Counters for tuning, expansions are summed over every replan
+        self.expansions = 0
+        self.resets = 0
+
+    def h(self, a: int, b: int) -> float:
+        return heuristic(*divmod(a, self.cols), *divmod(b, self.cols))
+
+    def neighbors(self, cell: int):
+        """Yield the walkable neighbors of a cell and the cost of moving to them."""
+        cells = self.walkable.ravel()
+        row, col = divmod(cell, self.cols)
+
+        for dr, dc, cost in NEIGHBORS:
+            r = row + dr
+            c = col + dc
+
+            if 0 <= r < self.rows and 0 <= c < self.cols and cells[r * self.cols + c]:
+                yield r * self.cols + c, cost
+
+    def key(self, cell: int) -> tuple[float, float]:
+        best = min(self.g.get(cell, math.inf), self.rhs.get(cell, math.inf))
+        return (round(best + self.h(self.target, cell) + self.km, KEY_DECIMALS), best)
+
+    def reset(self, anchor: int, target: int):
+        """Start a fresh search rooted at the anchor."""
+        self.anchor = anchor
+        self.target = target
+        self.km = 0.0
+        self.g: dict[int, float] = {}
+        self.rhs: dict[int, float] = {anchor: 0.0}
+        self.open_keys: dict[int, tuple[float, float]] = {}
+        self.open_heap: list[tuple[float, float, int]] = []
+        self.previous = set()
+        self.resets += 1
+        self.push(anchor)
+
+    def push(self, cell: int):
+        key = self.key(cell)
+        self.open_keys[cell] = key
+        heapq.heappush(self.open_heap, (key[0], key[1], cell))
+
+    def top_key(self) -> tuple[float, float]:
+        """Get the smallest key in the open set, dropping stale heap entries."""
+        while self.open_heap:
+            k1, k2, cell = self.open_heap[0]
+            if self.open_keys.get(cell) == (k1, k2):
+                return (k1, k2)
+            heapq.heappop(self.open_heap)
+        return (math.inf, math.inf)
+
+    def update_vertex(self, cell: int):
+        if not self.walkable.ravel()[cell]:
+            self.rhs[cell] = math.inf
+        elif cell != self.anchor:
+            weight = self.costs.ravel()[cell] if self.costs is not None else 1.0
+            self.rhs[cell] = min((self.g.get(n, math.inf) + cost * weight for n, cost in self.neighbors(cell)), default=math.inf)
+
+        self.open_keys.pop(cell, None)
+
+        if self.g.get(cell, math.inf) != self.rhs.get(cell, math.inf):
+            self.push(cell)
+
+    def compute(self):
+        """Expand cells until the distance from the anchor to the target is known."""
+        target = self.target
+
+        while self.top_key() < self.key(target) or self.rhs.get(target, math.inf) != self.g.get(target, math.inf):
+            k_old = self.top_key()
+
+            if k_old[0] == math.inf:
+                break
+
+            _, _, cell = heapq.heappop(self.open_heap)
+            del self.open_keys[cell]
+            k_new = self.key(cell)
+            self.expansions += 1
+
+            if k_old < k_new:
+                self.push(cell)
+            elif self.g.get(cell, math.inf) > self.rhs.get(cell, math.inf):
+                self.g[cell] = self.rhs[cell]
+                for neighbor, _ in self.neighbors(cell):
+                    self.update_vertex(neighbor)
+            else:
+                self.g[cell] = math.inf
+                self.update_vertex(cell)
+                for neighbor, _ in self.neighbors(cell):
+                    self.update_vertex(neighbor)
+
+    def extract(self, start: int) -> list[int] | None:
+        """Walk back from the target towards the anchor, preferring the previous path on ties.
+        Returns the path from start to the target, or None if start isn't on it."""
+        if self.g.get(self.target, math.inf) == math.inf:
+            return []
+
+        path = [self.target]
+
+        while path[-1] != start:
+            if path[-1] == self.anchor:
+                return None
+
+            best = None
+            best_cost = math.inf
+
+            weight = self.costs.ravel()[path[-1]] if self.costs is not None else 1.0
+
+            for neighbor, cost in self.neighbors(path[-1]):
+                total = self.g.get(neighbor, math.inf) + cost * weight
+                if total == math.inf:
+                    continue
+
+                if total < best_cost - 1e-9 or (abs(total - best_cost) <= 1e-9 and neighbor in self.previous):
+                    best = neighbor
+                    best_cost = total
+
+            path.append(best)
+
+        return path[::-1]
+
+    def update_cells(self, cells: list[int]):
+        """Mark cells whose walkability or cost changed, the search is repaired on the next plan."""
+        with self.__changes_lock:
+            self.__changed.update(cells)
+
+    def repair(self):
+        """Update the cells that changed since the last plan and their neighbors."""
+        with self.__changes_lock:
+            cells, self.__changed = self.__changed, set()
+
+        if self.anchor < 0:
+            return
+
+        for cell in cells:
+            for neighbor, _ in list(self.neighbors(cell)) + [(cell, 0.0)]:
+                self.update_vertex(neighbor)
+
+    def plan(self, start: int, target: int) -> list[int]:
+        """Get a path of cell ids from the agent's cell to the target's cell."""
+        with self.__lock:
+            cells = self.walkable.ravel()
+
+            if not cells[start] or not cells[target]:
+                return []
+
+            self.repair()
+
+            if self.anchor < 0:
+                self.reset(start, target)
+            elif target != self.target:
+                # Moving the target only shifts the heuristic, so the old keys stay usable
+                self.km += self.h(self.target, target)
+                self.target = target
+
+            self.compute()
+            path = self.extract(start)
+
+            # The agent left the planned path, so plan again from where it is
+            if path is None:
+                self.reset(start, target)
+                self.compute()
+                path = self.extract(start)
+
+            self.previous = set(path)
+            return path
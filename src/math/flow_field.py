@@ -0,0 +1,127 @@
+import heapq
+import numpy as np
+from pygame.math import Vector2
+
+from src.math.a_star import NEIGHBORS
+
+def integrate(walkable: np.ndarray, target: int, costs: np.ndarray = None, sources: set[int] = None) -> tuple[np.ndarray, np.ndarray]:
+    """Run Dijkstra outwards from the target cell over a 2D walkability grid, optionally
+    weighted by a grid of cell costs. Returns the distance to the target and the next cell
+    towards it for every cell id. If source cells are given, the search stops as soon as
+    all of them are reached, leaving the rest of the grid unexplored."""
+    rows, cols = walkable.shape
+    cells = walkable.ravel()
+    weights = costs.ravel() if costs is not None else None
+    remaining = set(sources) if sources is not None else None
+
+    distance = np.full(rows * cols, np.inf)
+    next_cell = np.full(rows * cols, -1, dtype=np.int64)
+
+    if not cells[target]:
+        return distance, next_cell
+
+    distance[target] = 0.0
+    next_cell[target] = target
+    open_heap = [(0.0, target)]
+
+    while open_heap:
+        current_distance, current = heapq.heappop(open_heap)
+
+        # Skip stale entries left behind by a cheaper push
+        if current_distance > distance[current]:
+            continue
+
+        if remaining is not None:
+            remaining.discard(current)
+            if not remaining:
+                break
+
+        row, col = divmod(current, cols)
+
+        for dr, dc, cost in NEIGHBORS:
+            r = row + dr
+            c = col + dc
+
+            if r < 0 or r >= rows or c < 0 or c >= cols:
+                continue
+
+            neighbor = r * cols + c
+
+            if not cells[neighbor]:
+                continue
+
+            # Moving from the neighbor into the current cell costs the current cell's weight
+            new_distance = current_distance + (cost if weights is None else cost * weights[current])
+
+            if new_distance < distance[neighbor]:
+                distance[neighbor] = new_distance
+                next_cell[neighbor] = current
+                heapq.heappush(open_heap, (new_distance, neighbor))
+
+    return distance, next_cell
+
+def trace(next_cell: np.ndarray, start: int) -> list[int]:
+    """Follow the next cells of an integration from a start cell to its target."""
+    if next_cell[start] < 0:
+        return []
+
+    path = [start]
+    while next_cell[path[-1]] != path[-1]:
+        path.append(int(next_cell[path[-1]]))
+    return path
+
+class FlowField:
+    """An integration field towards a single target that any number of agents can follow."""
+    def __init__(self, walkable: np.ndarray, tile_size: int, target: int, nearest: np.ndarray = None, costs: np.ndarray = None):
+        self.rows, self.cols = walkable.shape
+        self.tile_size = tile_size
+        self.target = target
+        self.nearest = nearest
+        self.distance, self.next = integrate(walkable, target, costs)
+
+    def cell_at(self, pos: tuple[int, int]) -> int:
+        """Get the cell id under a world position, clamped to the grid."""
+        row = min(max(int(pos[1]) // self.tile_size, 0), self.rows - 1)
+        col = min(max(int(pos[0]) // self.tile_size, 0), self.cols - 1)
+        return row * self.cols + col
+
+    def center(self, cell: int) -> Vector2:
+        """Get the world position of the center of a cell."""
+        row, col = divmod(cell, self.cols)
+        return Vector2((col + 0.5) * self.tile_size, (row + 0.5) * self.tile_size)
+
+    def next_cell(self, cell: int) -> int:
+        """Get the next cell towards the target, or -1 if the target can't be reached."""
+        if self.next[cell] >= 0:
+            return int(self.next[cell])
+
+        # Step onto the nearest walkable cell from a blocked cell
+        if self.nearest is not None and self.nearest[cell] >= 0 and self.next[self.nearest[cell]] >= 0:
+            return int(self.nearest[cell])
+
+        # Step back onto the field from a blocked or unreached cell
+        row, col = divmod(cell, self.cols)
+        best = -1
+
+        for dr, dc, _ in NEIGHBORS:
+            r = row + dr
+            c = col + dc
+
+            if r < 0 or r >= self.rows or c < 0 or c >= self.cols:
+                continue
+
+            neighbor = r * self.cols + c
+
+            if self.next[neighbor] >= 0 and (best < 0 or self.distance[neighbor] < self.distance[best]):
+                best = neighbor
+
+        return best
+
+    def next_position(self, pos: tuple[int, int]) -> Vector2 | None:
+        """Get the world position an agent at pos should move towards."""
+        cell = self.next_cell(self.cell_at(pos))
+
+        if cell < 0:
+            return None
+
+        return self.center(cell)
@@ -0,0 +1,319 @@
+import heapq
+import numpy as np
+
+from src.math import a_star
+
+# Border runs at least this long get an entrance at each end instead of one in the middle
+ENTRANCE_SPLIT = 6
+
+def distances(walkable: np.ndarray, sources: list[tuple[int, int]]) -> np.ndarray:
+    """Get the distance from each (row, col) source to every cell of a small grid, as a
+    (sources, rows, cols) array. All sources are relaxed together with whole-array
+    operations until nothing changes, which suits cluster-sized grids."""
+    rows, cols = walkable.shape
+    distance = np.full((len(sources), rows + 2, cols + 2), np.inf)
+
+    for i, (row, col) in enumerate(sources):
+        distance[i, row + 1, col + 1] = 0.0
+
+    inner = distance[:, 1:-1, 1:-1]
+    blocked = ~walkable
+
+    while True:
+        best = inner.copy()
+
+        for dr, dc, cost in a_star.NEIGHBORS:
+            np.minimum(best, distance[:, 1 + dr:1 + dr + rows, 1 + dc:1 + dc + cols] + cost, out=best)
+
+        best[:, blocked] = np.inf
+
+        if np.array_equal(best, inner):
+            return best
+
+        inner[...] = best
+
+def path_cost(path: list[int], cols: int) -> float:
+    """Get the length of a path of neighboring cells."""
+    cost = 0.0
+    for a, b in zip(path, path[1:]):
+        cost += a_star.heuristic(*divmod(a, cols), *divmod(b, cols))
+    return cost
+
+class Hierarchy:
+    """An abstract graph over a 2D walkability grid for hierarchical pathfinding (HPA*).
+    The grid is split into square clusters linked by entrance cells on their borders, and
+    the distances between the entrances of each cluster are precomputed. Queries search the
+    small abstract graph and only refine the segments they need into grid cells."""
+    def __init__(self, walkable: np.ndarray, cluster_size: int = 16):
+        self.walkable = walkable
+        self.rows, self.cols = walkable.shape
+        self.cluster_size = cluster_size
+
+        # Abstract graph from entrance cell id to neighboring entrance cell ids and costs
+        self.graph: dict[int, dict[int, float]] = {}
+        self.entrances: dict[tuple[int, int], list[int]] = {}
+
+        self.build_entrances()
+        self.build_edges()
+
+    def cluster(self, cell: int) -> tuple[int, int]:
+        """Get the (row, col) of the cluster a cell is in."""
+        row, col = divmod(cell, self.cols)
+        return row // self.cluster_size, col // self.cluster_size
+
+    def bounds(self, cluster: tuple[int, int]) -> tuple[int, int, int, int]:
+        """Get the first and last-plus-one row and column of a cluster."""
+        r0 = cluster[0] * self.cluster_size
+        c0 = cluster[1] * self.cluster_size
+        return r0, min(r0 + self.cluster_size, self.rows), c0, min(c0 + self.cluster_size, self.cols)
+
+    def add_entrance(self, a: int, b: int):
+        """Link two cells on either side of a cluster border."""
+        for cell, other in ((a, b), (b, a)):
+            if cell not in self.graph:
+                self.graph[cell] = {}
+                self.entrances.setdefault(self.cluster(cell), []).append(cell)
+            self.graph[cell][other] = 1.0
+
+    def build_entrances(self):
+        """Place entrances along every run of walkable cell pairs across cluster borders."""
+        size = self.cluster_size
+
+        # Vertical borders between horizontally adjacent clusters, then horizontal borders
+        for border in range(size, self.cols, size):
+            for start in range(0, self.rows, size):
+                self.add_segment(True, border, start)
+
+        for border in range(size, self.rows, size):
+            for start in range(0, self.cols, size):
+                self.add_segment(False, border, start)
+
+    def segment_pairs(self, vertical: bool, border: int, start: int) -> list[tuple[int, int]]:
+        """Get the pairs of cells facing each other across one cluster's stretch of a border.
+        Vertical borders lie between columns border - 1 and border, horizontal ones between rows."""
+        if vertical:
+            end = min(start + self.cluster_size, self.rows)
+            return [(i * self.cols + border - 1, i * self.cols + border) for i in range(start, end)]
+
+        end = min(start + self.cluster_size, self.cols)
+        return [((border - 1) * self.cols + i, border * self.cols + i) for i in range(start, end)]
+
+    def add_segment(self, vertical: bool, border: int, start: int):
+        """Add the entrances along one cluster's stretch of a border, split into runs at walls."""
+        cells = self.walkable.ravel()
+        pairs = self.segment_pairs(vertical, border, start)
+        i = 0
+
+        while i < len(pairs):
+            if not (cells[pairs[i][0]] and cells[pairs[i][1]]):
+                i += 1
+                continue
+
+            run_start = i
+            while i < len(pairs) and cells[pairs[i][0]] and cells[pairs[i][1]]:
+                i += 1
+
+            if i - run_start >= ENTRANCE_SPLIT:
+                self.add_entrance(*pairs[run_start])
+                self.add_entrance(*pairs[i - 1])
+            else:
+                self.add_entrance(*pairs[(run_start + i - 1) // 2])
+
+    def remove_segment(self, vertical: bool, border: int, start: int):
+        """Remove the links across one stretch of a border, and the entrances left with no other link."""
+        for a, b in self.segment_pairs(vertical, border, start):
+            if b not in self.graph.get(a, {}):
+                continue
+
+            del self.graph[a][b]
+            del self.graph[b][a]
+
+            for cell in (a, b):
+                cluster = self.cluster(cell)
+                if all(self.cluster(other) == cluster for other in self.graph[cell]):
+                    del self.graph[cell]
+                    self.entrances[cluster].remove(cell)
+                    for other in self.entrances[cluster]:
+                        self.graph[other].pop(cell, None)
+
+    def update(self, cells):
+        """Rebuild the entrances and edges around cells whose walkability changed, leaving the
+        rest of the abstract graph as it is. The walkability grid is shared, so it's already changed."""
+        size = self.cluster_size
+        segments = set()
+        clusters = set()
+
+        # Borders the changed cells sit on, as (vertical, border, start)
+        for cell in cells:
+            row, col = divmod(cell, self.cols)
+            clusters.add(self.cluster(cell))
+
+            if col % size == size - 1 and col + 1 < self.cols:
+                segments.add((True, col + 1, row - row % size))
+            if col % size == 0 and col > 0:
+                segments.add((True, col, row - row % size))
+            if row % size == size - 1 and row + 1 < self.rows:
+                segments.add((False, row + 1, col - col % size))
+            if row % size == 0 and row > 0:
+                segments.add((False, row, col - col % size))
+
+        for segment in segments:
+            self.remove_segment(*segment)
+            self.add_segment(*segment)
+
+            # Entrances changed on both sides of the border
+            for a, b in self.segment_pairs(*segment)[:1]:
+                clusters.update((self.cluster(a), self.cluster(b)))
+
+        # Replace the edges inside each touched cluster
+        for cluster in clusters:
+            entrances = self.entrances.get(cluster, [])
+
+            for cell in entrances:
+                self.graph[cell] = {other: cost for other, cost in self.graph[cell].items() if self.cluster(other) != cluster}
+
+            for cell, edges in zip(entrances, self.local_distances(cluster, entrances)):
+                self.graph[cell].update(edges)
+
+    def local_distances(self, cluster: tuple[int, int], cells: list[int]) -> list[dict[int, float]]:
+        """Get the distance from each cell to every entrance of a cluster, staying inside the cluster."""
+        r0, r1, c0, c1 = self.bounds(cluster)
+        entrances = self.entrances.get(cluster, [])
+        distance = distances(self.walkable[r0:r1, c0:c1], [(cell // self.cols - r0, cell % self.cols - c0) for cell in cells])
+
+        result = []
+        for i, cell in enumerate(cells):
+            edges = {}
+            for entrance in entrances:
+                d = distance[i, entrance // self.cols - r0, entrance % self.cols - c0]
+                if entrance != cell and np.isfinite(d):
+                    edges[entrance] = float(d)
+            result.append(edges)
+        return result
+
+    def build_edges(self):
+        """Precompute the edges between the entrances of each cluster."""
+        for cluster, cells in self.entrances.items():
+            for cell, edges in zip(cells, self.local_distances(cluster, cells)):
+                self.graph[cell].update(edges)
+
+    def local_search(self, start: int, target: int) -> list[int]:
+        """Find a path between two cells of the same cluster without leaving it."""
+        return self.window_search(start, target, *self.bounds(self.cluster(start)))
+
+    def nearby_search(self, start: int, target: int) -> list[int]:
+        """Find a path between two nearby cells inside a window around both of them."""
+        sr, sc = divmod(start, self.cols)
+        tr, tc = divmod(target, self.cols)
+        margin = self.cluster_size // 2
+
+        return self.window_search(
+            start, target,
+            max(min(sr, tr) - margin, 0), min(max(sr, tr) + margin + 1, self.rows),
+            max(min(sc, tc) - margin, 0), min(max(sc, tc) + margin + 1, self.cols),
+        )
+
+    def window_search(self, start: int, target: int, r0: int, r1: int, c0: int, c1: int) -> list[int]:
+        """Find a path between two cells without leaving the given rows and columns."""
+        width = c1 - c0
+
+        def to_local(cell: int) -> int:
+            row, col = divmod(cell, self.cols)
+            return (row - r0) * width + col - c0
+
+        path = a_star.search(np.ascontiguousarray(self.walkable[r0:r1, c0:c1]), to_local(start), to_local(target))
+        return [(r0 + i // width) * self.cols + c0 + i % width for i in path]
+
+    def refine(self, a: int, b: int) -> list[int]:
+        """Turn one abstract edge into the grid cells after a, up to and including b."""
+        if self.cluster(a) != self.cluster(b):
+            return [b]
+        return self.local_search(a, b)[1:]
+
+    def search(self, start: int, target: int, refine: int = None, stats: dict = None) -> list[int]:
+        """Find a path of cell ids between two cells. Only the first refine segments of the
+        abstract path are turned into grid cells, the rest are left as entrance waypoints.
+        Falls back to a full grid search if the abstract graph can't connect the cells."""
+        cells = self.walkable.ravel()
+
+        if not cells[start] or not cells[target]:
+            return []
+
+        if start == target:
+            return [start]
+
+        abstract, cost = self.abstract_search(start, target, stats)
+
+        # Nearby cells can also be joined directly, which avoids detours through entrances
+        if a_star.heuristic(*divmod(start, self.cols), *divmod(target, self.cols)) < self.cluster_size:
+            local = self.nearby_search(start, target)
+            if local and (not abstract or path_cost(local, self.cols) <= cost):
+                return local
+
+        if not abstract:
+            return a_star.search(self.walkable, start, target, stats=stats)
+
+        path = [start]
+        for i, (a, b) in enumerate(zip(abstract, abstract[1:])):
+            if refine is not None and i >= refine:
+                path.extend(abstract[i + 1:])
+                break
+            path.extend(self.refine(a, b))
+
+        return path
+
+    def abstract_search(self, start: int, target: int, stats: dict = None) -> tuple[list[int], float]:
+        """Run A* over the abstract graph with the start and target temporarily inserted.
+        Returns the abstract path and its cost."""
+        start_edges = self.local_distances(self.cluster(start), [start])[0]
+        target_edges = self.local_distances(self.cluster(target), [target])[0]
+
+        target_row, target_col = divmod(target, self.cols)
+
+        def heuristic(cell: int) -> float:
+            return a_star.heuristic(*divmod(cell, self.cols), target_row, target_col)
+
+        def edges(cell: int):
+            if cell == start:
+                yield from start_edges.items()
+            else:
+                yield from self.graph.get(cell, {}).items()
+            if cell in target_edges:
+                yield target, target_edges[cell]
+
+        g = {start: 0.0}
+        parent = {start: None}
+        closed = set()
+        open_heap = [(heuristic(start), 0.0, start)]
+        expansions = 0
+
+        while open_heap:
+            _, neg_g, current = heapq.heappop(open_heap)
+
+            if current in closed:
+                continue
+
+            if current == target:
+                break
+
+            closed.add(current)
+            expansions += 1
+
+            for neighbor, cost in edges(current):
+                cost_to_neighbor = -neg_g + cost
+
+                if neighbor not in closed and cost_to_neighbor < g.get(neighbor, np.inf):
+                    g[neighbor] = cost_to_neighbor
+                    parent[neighbor] = current
+                    heapq.heappush(open_heap, (cost_to_neighbor + heuristic(neighbor), -cost_to_neighbor, neighbor))
+
+        if stats is not None:
+            stats["expansions"] = expansions
+
+        if target not in parent:
+            return [], np.inf
+
+        path = [target]
+        while parent[path[-1]] is not None:
+            path.append(parent[path[-1]])
+        return path[::-1], g[target]
@@ -0,0 +1,232 @@
+import heapq
+import numpy as np
+
+from src.math.a_star import SearchContext, contexts, heuristic
+
+# Directions to expand from a cell that has no parent
+DIRECTIONS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+def _events_east(free: np.ndarray) -> np.ndarray:
+    """For every cell, get the column of the first cell at or east of it that is blocked
+    or has a forced neighbor when moving east, or cols if there is none."""
+    rows, cols = free.shape
+    padded = np.zeros((rows + 2, cols + 2), dtype=bool)
+    padded[1:-1, 1:-1] = free
+
+    up, down = padded[:-2, 1:-1], padded[2:, 1:-1]
+    up_next, down_next = padded[:-2, 2:], padded[2:, 2:]
+    forced = (down_next & ~down) | (up_next & ~up)
+
+    columns = np.where(~free | forced, np.arange(cols), cols)
+    return np.minimum.accumulate(columns[:, ::-1], axis=1)[:, ::-1].astype(np.int32)
+
+class JumpTable:
+    """Where each straight jump from every cell stops, precomputed once for a grid.
+    Rebuild it whenever the walkability of the grid changes."""
+    def __init__(self, walkable: np.ndarray):
+        rows, cols = walkable.shape
+        free = np.asarray(walkable, dtype=bool)
+
+        # Stopping column (east, west) or row (south, north) along each straight direction
+        self.east = _events_east(free)
+        self.west = (cols - 1 - _events_east(free[:, ::-1]))[:, ::-1]
+        self.south = _events_east(free.T).T
+        self.north = (rows - 1 - _events_east(free[::-1].T).T)[::-1]
+
+    def update(self, walkable: np.ndarray, cells):
+        """Recompute the jumps after some cells changed walkability. Forced neighbors look one
+        row or column to each side, so only the rows and columns next to the changed cells move."""
+        rows, cols = walkable.shape
+        free = np.asarray(walkable, dtype=bool)
+        changed = [divmod(cell, cols) for cell in cells]
+
+        if not changed:
+            return
+
+        # Rows around the changed cells, with one more row on each side for their forced neighbors
+        lo = max(min(row for row, _ in changed) - 1, 0)
+        hi = min(max(row for row, _ in changed) + 2, rows)
+        top, bottom = max(lo - 1, 0), min(hi + 1, rows)
+        slab = free[top:bottom]
+        self.east[lo:hi] = _events_east(slab)[lo - top:hi - top]
+        self.west[lo:hi] = (cols - 1 - _events_east(slab[:, ::-1]))[:, ::-1][lo - top:hi - top]
+
+        lo = max(min(col for _, col in changed) - 1, 0)
+        hi = min(max(col for _, col in changed) + 2, cols)
+        left, right = max(lo - 1, 0), min(hi + 1, cols)
+        slab = free[:, left:right]
+        self.south[:, lo:hi] = _events_east(slab.T).T[:, lo - left:hi - left]
+        self.north[:, lo:hi] = (rows - 1 - _events_east(slab[::-1].T).T)[::-1][:, lo - left:hi - left]
+
+def search(walkable: np.ndarray, start: int, target: int, context: SearchContext = None, stats: dict = None, jumps: JumpTable = None) -> list[int]:
+    """Find a path of jump points (cell ids) through a 2D walkability grid with Jump Point Search.
+    Moves match a_star.search, so diagonal steps may cut past blocked corners, and consecutive
+    jump points are always joined by a straight or diagonal run of walkable cells.
+    Pass the grid's JumpTable to avoid rebuilding it on every query."""
+    if context is None:
+        with contexts.context(walkable.size) as context:
+            return search(walkable, start, target, context, stats, jumps)
+
+    if jumps is None:
+        jumps = JumpTable(walkable)
+
+    rows, cols = walkable.shape
+
+    # Bytes index faster than NumPy arrays in the tight jump loops
+    cells = walkable.tobytes()
+
+    if not cells[start] or not cells[target]:
+        return []
+
+    if start == target:
+        return [start]
+
+    def free(r: int, c: int) -> bool:
+        return 0 <= r < rows and 0 <= c < cols and cells[r * cols + c]
+
+    target_row, target_col = divmod(target, cols)
+
+    def straight(r: int, c: int, dr: int, dc: int) -> int:
+        """Jump from (r, c) along a row or column using the jump table, or return -1."""
+        if not free(r, c):
+            return -1
+
+        if dc:
+            stop = int((jumps.east if dc > 0 else jumps.west)[r][c])
+            offset = (target_col - c) * dc
+            if r == target_row and 0 <= offset < (stop - c) * dc:
+                return target
+            return r * cols + stop if free(r, stop) else -1
+
+        stop = int((jumps.south if dr > 0 else jumps.north)[r][c])
+        offset = (target_row - r) * dr
+        if c == target_col and 0 <= offset < (stop - r) * dr:
+            return target
+        return stop * cols + c if free(stop, c) else -1
+
+    def jump(r: int, c: int, dr: int, dc: int) -> int:
+        """Step from (r, c) in a direction until reaching a jump point, or return -1."""
+        if not (dr and dc):
+            return straight(r, c, dr, dc)
+
+        while True:
+            if not free(r, c):
+                return -1
+
+            if r == target_row and c == target_col:
+                return target
+
+            # Forced neighbors around a blocked cell behind the diagonal
+            if (free(r + dr, c - dc) and not free(r, c - dc)) or (free(r - dr, c + dc) and not free(r - dr, c)):
+                return r * cols + c
+
+            # Any jump point along the straight directions makes this one too
+            if straight(r, c + dc, 0, dc) >= 0 or straight(r + dr, c, dr, 0) >= 0:
+                return r * cols + c
+
+            r += dr
+            c += dc
+
+    def directions(r: int, c: int, parent: int) -> list[tuple[int, int]]:
+        """Prune the directions to search from a cell given the direction it was reached from."""
+        if parent < 0:
+            return DIRECTIONS
+
+        pr, pc = divmod(parent, cols)
+        dr = (r > pr) - (r < pr)
+        dc = (c > pc) - (c < pc)
+
+        if dr and dc:
+            result = [(dr, 0), (0, dc), (dr, dc)]
+            if not free(r, c - dc):
+                result.append((dr, -dc))
+            if not free(r - dr, c):
+                result.append((-dr, dc))
+
+        elif dc:
+            result = [(0, dc)]
+            if not free(r + 1, c):
+                result.append((1, dc))
+            if not free(r - 1, c):
+                result.append((-1, dc))
+
+        else:
+            result = [(dr, 0)]
+            if not free(r, c + 1):
+                result.append((dr, 1))
+            if not free(r, c - 1):
+                result.append((dr, -1))
+
+        return result
+
+    # Per-query state, indexed by cell id
+    generation = context.begin()
+    g = context.g
+    parent = context.parent
+    seen = context.seen
+    closed = context.closed
+
+    start_row, start_col = divmod(start, cols)
+    g[start] = 0.0
+    parent[start] = -1
+    seen[start] = generation
+    open_heap = [(heuristic(start_row, start_col, target_row, target_col), 0.0, start)]
+    expansions = 0
+
+    while open_heap:
+        _, neg_g, current = heapq.heappop(open_heap)
+
+        # Skip stale entries left behind by a cheaper push
+        if closed[current] == generation:
+            continue
+
+        if current == target:
+            if stats is not None:
+                stats["expansions"] = expansions
+            return context.reconstruct(target)
+
+        closed[current] = generation
+        expansions += 1
+        current_g = -neg_g
+        row, col = divmod(current, cols)
+
+        for dr, dc in directions(row, col, int(parent[current])):
+            point = jump(row + dr, col + dc, dr, dc)
+
+            if point < 0 or closed[point] == generation:
+                continue
+
+            r, c = divmod(point, cols)
+            cost_to_point = current_g + heuristic(row, col, r, c)
+
+            if seen[point] != generation or cost_to_point < g[point]:
+                g[point] = cost_to_point
+                parent[point] = current
+                seen[point] = generation
+                f = cost_to_point + heuristic(r, c, target_row, target_col)
+                heapq.heappush(open_heap, (f, -cost_to_point, point))
+
+    if stats is not None:
+        stats["expansions"] = expansions
+
+    return []
+
+def expand(path: list[int], cols: int) -> list[int]:
+    """Fill in every cell between consecutive jump points."""
+    if not path:
+        return []
+
+    cells = [path[0]]
+
+    for a, b in zip(path, path[1:]):
+        r, c = divmod(a, cols)
+        br, bc = divmod(b, cols)
+        dr = (br > r) - (br < r)
+        dc = (bc > c) - (bc < c)
+
+        while (r, c) != (br, bc):
+            r += dr
+            c += dc
+            cells.append(r * cols + c)
+
+    return cells
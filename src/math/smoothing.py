@@ -0,0 +1,65 @@
+import numpy as np
+
+def line_cells(cols: int, a: int, b: int):
+    """Yield every cell the line between the centers of two cells passes through, starting with a.
+    Where the line passes exactly through a grid corner, both cells beside the corner are included."""
+    row, col = divmod(a, cols)
+    target_row, target_col = divmod(b, cols)
+
+    dr = abs(target_row - row)
+    dc = abs(target_col - col)
+    step_r = 1 if target_row > row else -1
+    step_c = 1 if target_col > col else -1
+
+    # Walk the grid cells crossed by the line, stepping along whichever side it crosses first
+    error = dc - dr
+    remaining = dr + dc
+
+    yield a
+
+    while remaining > 0:
+        if error > 0:
+            col += step_c
+            error -= 2 * dr
+            remaining -= 1
+        elif error < 0:
+            row += step_r
+            error += 2 * dc
+            remaining -= 1
+        else:
+            yield row * cols + col + step_c
+            yield (row + step_r) * cols + col
+            row += step_r
+            col += step_c
+            error += 2 * dc - 2 * dr
+            remaining -= 2
+
+        yield row * cols + col
+
+def line_of_sight(walkable: np.ndarray, a: int, b: int) -> bool:
+    """Check that every cell the line between the centers of two cells passes through is walkable.
+    Lines that pass exactly through a grid corner need both cells beside the corner to be walkable."""
+    cells = walkable.ravel()
+    return all(cells[cell] for cell in line_cells(walkable.shape[1], a, b))
+
+def path_crosses(cols: int, path: list[int], cells: set[int]) -> bool:
+    """Check whether the straight lines between consecutive waypoints of a path pass through any of the cells."""
+    if len(path) == 1:
+        return path[0] in cells
+
+    return any(cell in cells for a, b in zip(path, path[1:]) for cell in line_cells(cols, a, b))
+
+def smooth_path(walkable: np.ndarray, path: list[int]) -> list[int]:
+    """Pull a path of cell ids tight, keeping only the waypoints at its corners."""
+    if len(path) <= 2:
+        return path
+
+    result = [path[0]]
+
+    for i in range(2, len(path)):
+        # Keep the previous waypoint once the next one can't be seen from the last corner
+        if not line_of_sight(walkable, result[-1], path[i]):
+            result.append(path[i - 1])
+
+    result.append(path[-1])
+    return result